@@ -0,0 +1,196 @@
+"""
+Admission control for the Flask API
+
+Each group of endpoints gets its own lane with a bounded number of
+in-flight requests and a bounded wait queue. When a lane is saturated the
+request is turned away immediately with 429/503 and a Retry-After header
+instead of piling up until gunicorn kills the worker.
+
+Clients can send `X-Request-Timeout: <seconds>` to tell the server how long
+they are willing to wait. Work whose deadline has already passed is dropped
+with 504 instead of being computed for nobody.
+"""
+
+import math
+import threading
+import time
+from functools import wraps
+from flask import g, jsonify, request
+
+DEADLINE_HEADER = 'X-Request-Timeout'
+
+
+class AdmissionRejected(Exception):
+    """Raised when a lane refuses to admit a request"""
+
+    def __init__(self, status, message, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.retry_after = retry_after
+
+    def to_response(self):
+        response = jsonify({'error': self.message})
+        response.status_code = self.status
+        if self.retry_after is not None:
+            response.headers['Retry-After'] = str(self.retry_after)
+        return response
+
+
+class AdmissionLane:
+    """
+    Bounded concurrency + bounded queue for one class of traffic
+    - max_inflight: requests allowed to run at the same time
+    - max_queue: requests allowed to wait for a free slot
+    - queue_timeout: seconds a queued request waits before giving up (503)
+    """
+
+    def __init__(self, name, max_inflight, max_queue, queue_timeout):
+        self.name = name
+        self.max_inflight = max(1, int(max_inflight))
+        self.max_queue = max(0, int(max_queue))
+        self.queue_timeout = float(queue_timeout)
+        self._cond = threading.Condition()
+        self._inflight = 0
+        self._waiting = 0
+        # Exponentially weighted mean service time, used for Retry-After
+        self._service_time = 0.0
+        self._counters = {
+            'admitted': 0,
+            'rejected_queue_full': 0,
+            'rejected_queue_timeout': 0,
+            'deadline_expired': 0
+        }
+
+    def retry_after(self):
+        """Estimate (in whole seconds) when a slot is likely to be free"""
+        backlog = self._waiting + 1
+        estimate = self._service_time * backlog / self.max_inflight
+        return max(1, int(math.ceil(estimate)))
+
+    def acquire(self, deadline=None):
+        """
+        Take an in-flight slot, waiting in the queue if needed
+        Raises AdmissionRejected if the lane is full or the wait expires
+        """
+        with self._cond:
+            if deadline is not None and time.monotonic() >= deadline:
+                self._counters['deadline_expired'] += 1
+                raise AdmissionRejected(504, 'Request deadline already expired')
+
+            if self._inflight < self.max_inflight and self._waiting == 0:
+                self._inflight += 1
+                self._counters['admitted'] += 1
+                return
+
+            if self._waiting >= self.max_queue:
+                self._counters['rejected_queue_full'] += 1
+                raise AdmissionRejected(
+                    429,
+                    f'Server busy ({self.name} queue full). Please retry later.',
+                    self.retry_after()
+                )
+
+            wait_until = time.monotonic() + self.queue_timeout
+            if deadline is not None:
+                wait_until = min(wait_until, deadline)
+
+            self._waiting += 1
+            try:
+                while self._inflight >= self.max_inflight:
+                    remaining = wait_until - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+            finally:
+                self._waiting -= 1
+
+            if self._inflight >= self.max_inflight:
+                if deadline is not None and time.monotonic() >= deadline:
+                    self._counters['deadline_expired'] += 1
+                    raise AdmissionRejected(504, 'Request deadline expired while queued')
+                self._counters['rejected_queue_timeout'] += 1
+                raise AdmissionRejected(
+                    503,
+                    f'Server busy ({self.name} queue timeout). Please retry later.',
+                    self.retry_after()
+                )
+
+            self._inflight += 1
+            self._counters['admitted'] += 1
+
+    def release(self, service_time=None):
+        """Give back an in-flight slot and wake the next queued request"""
+        with self._cond:
+            self._inflight -= 1
+            if service_time is not None:
+                if self._service_time == 0.0:
+                    self._service_time = service_time
+                else:
+                    self._service_time = 0.8 * self._service_time + 0.2 * service_time
+            self._cond.notify()
+
+    def stats(self):
+        """Snapshot of lane occupancy and counters"""
+        with self._cond:
+            return {
+                'inflight': self._inflight,
+                'queued': self._waiting,
+                'max_inflight': self.max_inflight,
+                'max_queue': self.max_queue,
+                'mean_service_time': round(self._service_time, 4),
+                **self._counters
+            }
+
+
+def parse_deadline(headers):
+    """
+    Convert the client's X-Request-Timeout header (seconds) into a
+    time.monotonic() deadline. Returns None when absent or invalid.
+    """
+    value = headers.get(DEADLINE_HEADER)
+    if not value:
+        return None
+    try:
+        timeout = float(value)
+    except ValueError:
+        return None
+    if timeout <= 0 or math.isnan(timeout):
+        return None
+    return time.monotonic() + timeout
+
+
+def deadline_exceeded():
+    """True if the current request's client deadline has passed"""
+    deadline = g.get('request_deadline')
+    return deadline is not None and time.monotonic() >= deadline
+
+
+def deadline_response():
+    """Standard response for work dropped because the caller gave up"""
+    return AdmissionRejected(504, 'Request deadline expired').to_response()
+
+
+def admit(lane):
+    """
+    Decorator that runs a view inside an admission lane
+    The client deadline is stored on flask.g so the view can check it
+    between expensive steps via deadline_exceeded().
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            deadline = parse_deadline(request.headers)
+            g.request_deadline = deadline
+            try:
+                lane.acquire(deadline)
+            except AdmissionRejected as e:
+                return e.to_response()
+
+            start = time.monotonic()
+            try:
+                return view(*args, **kwargs)
+            finally:
+                lane.release(time.monotonic() - start)
+        return wrapper
+    return decorator
@@ -1,17 +1,33 @@
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 from pymongo import MongoClient
-import tensorflow as tf
+import hmac
 import os
+import threading
+import time
 from werkzeug.utils import secure_filename
 from config import Config
 from utils import (
     allowed_file, 
+    validate_image_header,
+    record_rejection,
+    get_rejection_stats,
+    ImageRejected,
     preprocess_image, 
     get_prediction_label, 
     save_prediction_to_db,
     create_upload_folder
 )
+from upload_store import save_upload, record_upload, find_blob, start_sweeper
+from gradcam import HeatmapCache, render_overlay, to_data_url
+from tta import predict_tta, record_single_pass
+from near_duplicates import perceptual_hash
+from cascade import Cascade
+from response_cache import cached_response
+from rollups import ensure_indexes, parse_time, query_rollups
+from model_registry import ModelRegistry, CURRENT_POINTER, SHADOW_POINTER
+from admission import AdmissionLane, admit, deadline_exceeded, deadline_response
+from tf_threads import configure_threads
 
 # Initialize Flask app
 app = Flask(__name__)
@@ -26,6 +42,28 @@ else:
 # Create upload folder
 create_upload_folder()
 
+# Admission lanes: inference, explanations and dashboard reads are limited separately
+predict_lane = AdmissionLane(
+    'predict',
+    Config.PREDICT_MAX_INFLIGHT,
+    Config.PREDICT_MAX_QUEUE,
+    Config.PREDICT_QUEUE_TIMEOUT
+)
+read_lane = AdmissionLane(
+    'read',
+    Config.READ_MAX_INFLIGHT,
+    Config.READ_MAX_QUEUE,
+    Config.READ_QUEUE_TIMEOUT
+)
+
+explain_lane = AdmissionLane(
+    'explain',
+    Config.EXPLAIN_MAX_INFLIGHT,
+    Config.EXPLAIN_MAX_QUEUE,
+    Config.EXPLAIN_QUEUE_TIMEOUT
+)
+heatmap_cache = HeatmapCache()
+
 # MongoDB connection
 try:
     client = MongoClient(Config.MONGO_URI)
@@ -35,69 +73,175 @@ except Exception as e:
     print(f"❌ MongoDB connection error: {str(e)}")
     db = None
 
-# Load the trained model
-model = None
+# Index used by ranged /stats queries. Built in the background: MongoClient
+# connects lazily and an unreachable server must not block startup.
+if db is not None:
+    threading.Thread(target=ensure_indexes, args=(db,), daemon=True).start()
+
+def sweep_heatmaps():
+    """Keep only the served version's overlays, within the cache budget"""
+    active = registry.current
+    result = heatmap_cache.sweep({active.version} if active else set())
+    if result['versions_removed'] or result['evicted']:
+        print(f"🧹 Heatmap sweep removed {result['versions_removed']} old versions, "
+              f"{result['evicted']} overlays")
+
+# Keep the upload store (and the Grad-CAM overlay cache) within budget
+start_sweeper(db, tasks=(sweep_heatmaps,))
+
+# Size TensorFlow's thread pools before the first model is loaded
+configure_threads()
+
+# Load the trained model (versioned registry, falling back to MODEL_PATH)
+registry = ModelRegistry()
 try:
-    if os.path.exists(Config.MODEL_PATH):
-        model = tf.keras.models.load_model(Config.MODEL_PATH)
-        print("✅ Model loaded successfully")
-    else:
+    registry.refresh()
+    if registry.current is None:
         print("⚠️  Model file not found. Please train the model first.")
 except Exception as e:
     print(f"❌ Error loading model: {str(e)}")
 
+# Hot-reload when model/versions/CURRENT or SHADOW changes
+registry.start_watcher()
+
+# Optional cascade: a fast CNN answers confident cases, the served model the rest
+cascade = None
+if Config.CASCADE_ENABLED:
+    try:
+        cascade = Cascade()
+    except Exception as e:
+        print(f"❌ Error loading cascade fast model: {str(e)}")
+
+def validate_upload():
+    """
+    Request-level checks shared by /predict and /explain
+    Returns the uploaded FileStorage or raises ImageRejected
+    """
+    # Check if file is in request
+    if 'file' not in request.files:
+        record_rejection('no_file')
+        raise ImageRejected('no_file', 'No file provided')
+    
+    file = request.files['file']
+    
+    # Check if file is selected
+    if file.filename == '':
+        record_rejection('no_file')
+        raise ImageRejected('no_file', 'No file selected')
+    
+    # Check if file is allowed
+    if not allowed_file(file.filename):
+        record_rejection('invalid_extension')
+        raise ImageRejected(
+            'invalid_extension',
+            'Invalid file type. Only PNG, JPG, JPEG allowed.'
+        )
+    
+    # Cheap header-only check before any decoding or disk write
+    validate_image_header(file.stream)
+    return file
+
+def store_upload(file):
+    """
+    Save an uploaded file under its content hash (dedups identical images)
+    Returns (filename, digest, filepath)
+    """
+    filename = secure_filename(file.filename)
+    digest, filepath, size, _ = save_upload(file, filename)
+    if db is not None:
+        record_upload(db, digest, filepath, size, filename)
+    return filename, digest, filepath
+
 @app.route('/', methods=['GET'])
 def home():
     """Health check endpoint"""
     return jsonify({
         'status': 'running',
         'message': 'Pneumonia Detection API is running',
-        'model_loaded': model is not None,
-        'database_connected': db is not None
+        'model_loaded': registry.current is not None,
+        'model_version': registry.current.version if registry.current else None,
+        'database_connected': db is not None,
+        'admission': {
+            'predict': predict_lane.stats(),
+            'read': read_lane.stats(),
+            'explain': explain_lane.stats()
+        },
+        'rejections': get_rejection_stats(),
+        'near_duplicates': registry.current.near_duplicates.stats() if registry.current else None,
+        'cascade': cascade.stats() if cascade else None
     })
 
 @app.route('/predict', methods=['POST'])
+@admit(predict_lane)
 def predict():
     """
     Main prediction endpoint
     Accepts image file and returns prediction
     """
-    # Check if model is loaded
-    if model is None:
+    # Check if model is loaded (hold one version for the whole request)
+    active = registry.current
+    if active is None:
         return jsonify({
             'error': 'Model not loaded. Please train the model first.'
         }), 500
     
-    # Check if file is in request
-    if 'file' not in request.files:
-        return jsonify({'error': 'No file provided'}), 400
-    
-    file = request.files['file']
-    
-    # Check if file is selected
-    if file.filename == '':
-        return jsonify({'error': 'No file selected'}), 400
-    
-    # Check if file is allowed
-    if not allowed_file(file.filename):
-        return jsonify({
-            'error': 'Invalid file type. Only PNG, JPG, JPEG allowed.'
-        }), 400
+    try:
+        file = validate_upload()
+    except ImageRejected as e:
+        return jsonify({'error': e.message, 'reason': e.reason}), e.status
     
     try:
         # Save uploaded file
-        filename = secure_filename(file.filename)
-        filepath = os.path.join(Config.UPLOAD_FOLDER, filename)
-        file.save(filepath)
+        filename, digest, filepath = store_upload(file)
         
         # Preprocess image
-        img_array = preprocess_image(filepath)
+        img_array = preprocess_image(filepath, active.input_shape)
         if img_array is None:
             return jsonify({'error': 'Error processing image'}), 500
         
+        # Client already gave up - don't spend a forward pass on it
+        if deadline_exceeded():
+            return deadline_response()
+        
+        # Near-duplicate of an earlier upload (resized / recompressed copy)?
+        phash = perceptual_hash(img_array)
+        duplicate = None
+        reuse = request.values.get('reuse')
+        if (Config.NEAR_DUPLICATE_REUSE if reuse is None
+                else reuse.lower() in ('1', 'true', 'yes')):
+            duplicate = active.near_duplicates.lookup(phash)
+        
         # Make prediction
-        prediction = model.predict(img_array)
-        prediction_value = prediction[0][0]
+        tta_details = None
+        cascade_details = None
+        embedding = None
+        fast_embedding = None
+        if duplicate is not None:
+            # Reuse the earlier result instead of running the model
+            prediction_value = duplicate['score']
+        elif request.values.get('tta', '').lower() in ('1', 'true', 'yes'):
+            # Augmented copies scored in one batched forward pass
+            prediction_value, embedding, tta_details = predict_tta(active, img_array)
+        elif cascade is not None:
+            # Fast model first; the served model only when it is unsure
+            prediction_value, embedding, fast_embedding, cascade_details = cascade.predict(
+                active, filepath, img_array
+            )
+        else:
+            start = time.perf_counter()
+            # Same forward pass also yields the embedding for /similar
+            prediction, embeddings = active.predict_with_embedding(img_array)
+            latency = time.perf_counter() - start
+            if embeddings is not None:
+                embedding = embeddings[0]
+            prediction_value = prediction[0][0]
+            record_single_pass(latency)
+            
+            # Compare against the candidate model off the request path (if enabled)
+            registry.shadow.maybe_submit(img_array, float(prediction_value), latency, filepath)
+        
+        # The fast cascade model may have answered instead of the served one
+        model_version = cascade_details['answered_by'] if cascade_details else active.version
         
         # Calculate confidence (using optimal threshold 0.50 from Transfer Learning)
         confidence = float(prediction_value) if prediction_value >= 0.50 else float(1 - prediction_value)
@@ -107,22 +251,206 @@ def predict():
         
         # Save to database
         if db is not None:
-            save_prediction_to_db(db, filename, label, confidence)
+            save_prediction_to_db(
+                db, filename, label, confidence, image_digest=digest, phash=phash,
+                duplicate_of=duplicate['image_digest'] if duplicate else None,
+                model_version=model_version
+            )
+
+        # Make this case retrievable by /similar and by later near-duplicates
+        if embedding is not None:
+            active.index.add(digest, label, float(prediction_value), embedding)
+        if fast_embedding is not None and cascade.index is not None:
+            # Fast-model space: covers every image the cascade saw, escalated or not
+            cascade.index.add(digest, label, float(prediction_value), fast_embedding)
+        # Only the served model's own scores are reused for its near-duplicates
+        if duplicate is None and model_version == active.version:
+            active.near_duplicates.add(phash, digest, label, float(prediction_value))
+
+        # Return result
+        result = {
+            'prediction': label,
+            'confidence': round(confidence * 100, 2),
+            'filename': filename,
+            'image_digest': digest,
+            'model_version': model_version
+        }
+        if tta_details is not None:
+            result['tta'] = tta_details
+        if cascade_details is not None:
+            result['cascade'] = cascade_details
+        if duplicate is not None:
+            result['duplicate_of'] = {
+                'image_digest': duplicate['image_digest'],
+                'distance': duplicate['distance']
+            }
+        return jsonify(result)
+    
+    except Exception as e:
+        return jsonify({'error': f'Prediction failed: {str(e)}'}), 500
+
+@app.route('/explain', methods=['POST'])
+@app.route('/explain/<digest>', methods=['GET'])
+@admit(explain_lane)
+def explain(digest=None):
+    """
+    Grad-CAM explanation endpoint
+    POST an image file, or GET with the image_digest returned by /predict,
+    to receive a heatmap overlay of the regions driving the prediction
+    """
+    active = registry.current
+    if active is None:
+        return jsonify({
+            'error': 'Model not loaded. Please train the model first.'
+        }), 500
+    
+    if digest is None:
+        try:
+            file = validate_upload()
+        except ImageRejected as e:
+            return jsonify({'error': e.message, 'reason': e.reason}), e.status
+    
+    try:
+        if digest is None:
+            _, digest, filepath = store_upload(file)
+        else:
+            filepath = find_blob(digest)
+            if filepath is None:
+                return jsonify({'error': 'Image not found'}), 404
         
-        # Clean up uploaded file (optional)
-        # os.remove(filepath)
+        cached = heatmap_cache.get(digest, active.version)
+        if cached is not None:
+            png_bytes, prediction_value = cached
+        else:
+            img_array = preprocess_image(filepath, active.input_shape)
+            if img_array is None:
+                return jsonify({'error': 'Error processing image'}), 500
+            
+            if deadline_exceeded():
+                return deadline_response()
+            
+            # Coalesced with concurrent /explain requests into one batch
+            heatmap, prediction_value = active.explainer.explain(
+                img_array, timeout=Config.EXPLAIN_QUEUE_TIMEOUT
+            )
+            png_bytes = render_overlay(filepath, heatmap, prediction_value)
+            heatmap_cache.put(digest, active.version, png_bytes)
+        
+        confidence = prediction_value if prediction_value >= 0.50 else 1 - prediction_value
+        label = get_prediction_label(prediction_value, confidence)
         
-        # Return result
         return jsonify({
             'prediction': label,
             'confidence': round(confidence * 100, 2),
-            'filename': filename
+            'image_digest': digest,
+            'model_version': active.version,
+            'cached': cached is not None,
+            'heatmap': to_data_url(png_bytes)
         })
     
     except Exception as e:
-        return jsonify({'error': f'Prediction failed: {str(e)}'}), 500
+        return jsonify({'error': f'Explanation failed: {str(e)}'}), 500
+
+@app.route('/similar/<digest>', methods=['GET'])
+@admit(read_lane)
+def similar(digest):
+    """
+    Previously predicted cases most similar to an image, by cosine
+    similarity of penultimate-layer embeddings. The image must have been
+    sent to /predict with the currently served model (or, with the cascade
+    on, its fast model: then neighbours come from the fast model's index).
+    Query: ?k=5
+    """
+    active = registry.current
+    if active is None:
+        return jsonify({
+            'error': 'Model not loaded. Please train the model first.'
+        }), 500
+    # (index, model version) pairs to look the image up in, served model first
+    indexes = [(active.index, active.version)]
+    if cascade is not None:
+        indexes.append((cascade.index, cascade.version))
+    indexes = [(index, version) for index, version in indexes if index is not None]
+    if not indexes:
+        return jsonify({'error': 'Similar-case search is not available for this model'}), 501
+
+    try:
+        k = int(request.args.get('k', 5))
+        bytes.fromhex(digest)
+    except ValueError:
+        return jsonify({'error': 'Invalid k or image digest'}), 400
+    if not 1 <= k <= Config.SIMILAR_MAX_K:
+        return jsonify({'error': f'k must be between 1 and {Config.SIMILAR_MAX_K}'}), 400
+
+    try:
+        for index, version in indexes:
+            embedding = index.get_embedding(digest)
+            if embedding is not None:
+                break
+        else:
+            return jsonify({'error': 'Image not indexed. Send it to /predict first.'}), 404
+
+        start = time.perf_counter()
+        neighbors = index.search(embedding, k=k, exclude_digest=digest)
+        return jsonify({
+            'image_digest': digest,
+            'model_version': version,
+            'similar': neighbors,
+            'search_ms': round((time.perf_counter() - start) * 1000.0, 2)
+        })
+    except Exception as e:
+        return jsonify({'error': f'Similar-case search failed: {str(e)}'}), 500
+
+def require_admin():
+    """Admin endpoints are disabled unless ADMIN_TOKEN is configured"""
+    if not Config.ADMIN_TOKEN:
+        return jsonify({'error': 'Admin endpoints are disabled'}), 403
+    token = request.headers.get('X-Admin-Token', '')
+    if not hmac.compare_digest(token.encode(), Config.ADMIN_TOKEN.encode()):
+        return jsonify({'error': 'Invalid admin token'}), 401
+    return None
+
+@app.route('/admin/models', methods=['GET'])
+def list_models():
+    """
+    Served version, available versions and shadow comparison stats
+    """
+    denied = require_admin()
+    if denied:
+        return denied
+    return jsonify(registry.describe())
+
+@app.route('/admin/models/<pointer>', methods=['POST'])
+def set_model_pointer(pointer):
+    """
+    Promote a version (pointer=current) or set the shadow candidate
+    (pointer=shadow, version=null to disable). Body: {"version": "..."}
+    Every worker picks up the change within MODEL_WATCH_INTERVAL; this one
+    starts loading immediately in the background.
+    """
+    denied = require_admin()
+    if denied:
+        return denied
+    
+    pointers = {'current': CURRENT_POINTER, 'shadow': SHADOW_POINTER}
+    if pointer not in pointers:
+        return jsonify({'error': f'Unknown pointer: {pointer}'}), 404
+    
+    version = (request.get_json(silent=True) or {}).get('version')
+    if pointer == 'current' and not version:
+        return jsonify({'error': 'No version provided'}), 400
+    
+    try:
+        registry.write_pointer(pointers[pointer], version)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 404
+    
+    registry.refresh_async()
+    return jsonify({'status': 'reloading', pointer: version}), 202
 
 @app.route('/history', methods=['GET'])
+@cached_response
+@admit(read_lane)
 def get_history():
     """
     Get prediction history from database
@@ -145,13 +473,36 @@ def get_history():
         return jsonify({'error': f'Failed to fetch history: {str(e)}'}), 500
 
 @app.route('/stats', methods=['GET'])
+@cached_response
+@admit(read_lane)
 def get_stats():
     """
     Get prediction statistics
+    With ?from=&to=[&granularity=hour|day] returns a time series read from
+    the pre-aggregated rollups instead of the raw predictions
     """
     if db is None:
         return jsonify({'error': 'Database not connected'}), 500
     
+    if 'from' in request.args or 'to' in request.args:
+        try:
+            start = parse_time(request.args['from'])
+            end = parse_time(request.args['to'])
+            granularity = request.args.get('granularity', 'day')
+            series = query_rollups(db, start, end, granularity)
+        except (KeyError, ValueError) as e:
+            message = f"Missing parameter: {e.args[0]}" if isinstance(e, KeyError) else str(e)
+            return jsonify({'error': f'Invalid range query. {message}'}), 400
+        except Exception as e:
+            return jsonify({'error': f'Failed to fetch stats: {str(e)}'}), 500
+        
+        return jsonify({
+            'from': start.isoformat(),
+            'to': end.isoformat(),
+            'granularity': granularity,
+            'series': series
+        })
+    
     try:
         total = db.predictions.count_documents({})
         pneumonia_count = db.predictions.count_documents({'result': 'PNEUMONIA'})
@@ -0,0 +1,187 @@
+"""
+Thread-pool / worker autotuner
+
+Sweeps gunicorn worker count x TensorFlow intra-op threads x inter-op
+threads x batch size on this machine. Each configuration starts `workers`
+processes that load the model with those thread settings and run
+inference flat out at the same time, which is what a busy server does.
+
+/predict scores one image per forward pass, so the serving recommendation
+(workers and thread pools) is the batch-1 configuration with the highest
+throughput whose p99 meets --target-p99. The batch size for bulk_score.py
+and Grad-CAM batching is reported separately: the highest-throughput batch
+size under that serving configuration.
+
+Combinations that oversubscribe the CPU (workers x intra-op > cores) are
+skipped unless --include-oversubscribed is given.
+
+Usage:
+    python autotune.py --target-p99 250
+    python autotune.py --workers 1 2 4 --intra 1 2 4 --inter 1 2 --batch 1 8 --json autotune.json
+"""
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import time
+import numpy as np
+from config import Config
+
+
+def _probe(model_path, fmt, intra, inter, batch_sizes, duration, barrier, results):
+    """One simulated worker: configure threads, load, then run each batch size flat out"""
+    from tf_threads import configure_threads
+    configure_threads(intra, inter)
+
+    if fmt == 'tflite':
+        from model_artifact import TFLiteModel, tflite_path_for
+        model = TFLiteModel(tflite_path_for(model_path), interpreters=1, num_threads=intra or None)
+    else:
+        import tensorflow as tf
+        model = tf.keras.models.load_model(model_path)
+    shape = tuple(model.input_shape[1:])
+
+    for batch in batch_sizes:
+        x = np.random.rand(batch, *shape).astype(np.float32)
+        for _ in range(2):
+            model.predict(x, batch_size=batch, verbose=0)
+
+        # All workers measure the same batch size at the same time
+        barrier.wait()
+        latencies = []
+        end = time.perf_counter() + duration
+        while time.perf_counter() < end:
+            start = time.perf_counter()
+            model.predict(x, batch_size=batch, verbose=0)
+            latencies.append((time.perf_counter() - start) * 1000.0)
+        results.put((batch, latencies))
+        barrier.wait()
+
+
+def run_config(model_path, fmt, workers, intra, inter, batch_sizes, duration):
+    """Measure one (workers, intra, inter) setting for every batch size"""
+    context = multiprocessing.get_context('spawn')
+    barrier = context.Barrier(workers)
+    results = context.Queue()
+    processes = [
+        context.Process(target=_probe, args=(model_path, fmt, intra, inter, batch_sizes,
+                                             duration, barrier, results))
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    collected = {batch: [] for batch in batch_sizes}
+    for _ in range(workers * len(batch_sizes)):
+        batch, latencies = results.get()
+        collected[batch].append(latencies)
+    for process in processes:
+        process.join()
+
+    rows = []
+    for batch in batch_sizes:
+        latencies = np.concatenate([np.asarray(l) for l in collected[batch]])
+        rows.append({
+            'workers': workers,
+            'intra_op': intra,
+            'inter_op': inter,
+            'batch_size': batch,
+            'throughput_ips': round(len(latencies) * batch / duration, 1),
+            'p50_ms': round(float(np.percentile(latencies, 50)), 2),
+            'p99_ms': round(float(np.percentile(latencies, 99)), 2)
+        })
+    return rows
+
+
+def recommend(rows, target_p99):
+    """
+    Serving config: highest batch-1 throughput within the p99 target
+    (lowest p99 if nothing meets it)
+    """
+    single = [row for row in rows if row['batch_size'] == 1]
+    meeting = [row for row in single if row['p99_ms'] <= target_p99]
+    if meeting:
+        return max(meeting, key=lambda row: (row['throughput_ips'], -row['p99_ms'])), True
+    return min(single, key=lambda row: row['p99_ms']), False
+
+
+def recommend_batch(rows, serving):
+    """Highest-throughput batch size under the serving thread configuration"""
+    same = [row for row in rows
+            if (row['workers'], row['intra_op'], row['inter_op'])
+            == (serving['workers'], serving['intra_op'], serving['inter_op'])]
+    return max(same, key=lambda row: row['throughput_ips'])
+
+
+def powers_of_two(limit):
+    values, value = [], 1
+    while value <= limit:
+        values.append(value)
+        value *= 2
+    return values
+
+
+def main():
+    cores = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description='Sweep worker/thread/batch settings')
+    parser.add_argument('--model', default=Config.MODEL_PATH)
+    parser.add_argument('--format', default=Config.MODEL_FORMAT, choices=['h5', 'tflite'])
+    parser.add_argument('--target-p99', type=float, default=250.0, help='ms per forward pass')
+    parser.add_argument('--workers', type=int, nargs='+', default=powers_of_two(cores))
+    parser.add_argument('--intra', type=int, nargs='+', default=powers_of_two(cores),
+                        help='intra-op threads per worker (0 = TensorFlow default)')
+    parser.add_argument('--inter', type=int, nargs='+', default=[1, 2])
+    parser.add_argument('--batch', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--duration', type=float, default=5.0, help='seconds per measurement')
+    parser.add_argument('--include-oversubscribed', action='store_true')
+    parser.add_argument('--json', help='also write all results to this file')
+    args = parser.parse_args()
+    # The serving recommendation is made from batch-1 rows
+    batch_sizes = sorted(set(args.batch) | {1})
+
+    configs = [
+        (workers, intra, inter)
+        for workers, intra, inter in itertools.product(args.workers, args.intra, args.inter)
+        if args.include_oversubscribed or workers * (intra or cores) <= cores
+    ]
+
+    print("=" * 72)
+    print(f"🚀 Autotune: {len(configs)} thread configurations x {len(batch_sizes)} batch sizes "
+          f"on {cores} cores")
+    print("=" * 72)
+    print(f"{'workers':>7s} {'intra':>5s} {'inter':>5s} {'batch':>5s} "
+          f"{'img/s':>9s} {'p50 ms':>9s} {'p99 ms':>9s}")
+
+    rows = []
+    for workers, intra, inter in configs:
+        for row in run_config(args.model, args.format, workers, intra, inter,
+                              batch_sizes, args.duration):
+            rows.append(row)
+            print(f"{row['workers']:>7d} {row['intra_op']:>5d} {row['inter_op']:>5d} "
+                  f"{row['batch_size']:>5d} {row['throughput_ips']:>9.1f} "
+                  f"{row['p50_ms']:>9.2f} {row['p99_ms']:>9.2f}")
+
+    best, met = recommend(rows, args.target_p99)
+    batch = recommend_batch(rows, best)
+    print("=" * 72)
+    if met:
+        print(f"✅ Serving (batch 1) within p99 <= {args.target_p99:.0f} ms: "
+              f"{best['throughput_ips']:.1f} img/s at p99 {best['p99_ms']:.2f} ms")
+    else:
+        print(f"⚠️  Nothing meets p99 <= {args.target_p99:.0f} ms at batch 1; lowest p99 is "
+              f"{best['p99_ms']:.2f} ms")
+    print(f"   WEB_CONCURRENCY={best['workers']} TF_INTRA_OP_THREADS={best['intra_op']} "
+          f"TF_INTER_OP_THREADS={best['inter_op']}")
+    print(f"📦 Batch size {batch['batch_size']} for bulk_score.py --batch-size and GRADCAM_MAX_BATCH "
+          f"({batch['throughput_ips']:.1f} img/s under that configuration)")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'cores': cores, 'target_p99_ms': args.target_p99,
+                       'recommended': best, 'recommended_batch': batch,
+                       'results': rows}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+"""
+Benchmark: native grayscale CNN vs RGB CNN
+
+Compares the two build_cnn_model variants on
+- parameters and first-layer multiply-accumulates
+- preprocessing time and peak decode memory (RSS, fresh process) per image
+- forward-pass latency at several batch sizes
+- test accuracy (when trained models and the dataset are available)
+
+Usage:
+    python benchmark_grayscale.py
+    python benchmark_grayscale.py --rgb-model model/rgb.h5 --gray-model model/gray.h5
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+import numpy as np
+from PIL import Image
+from tensorflow import keras
+from train_model import build_cnn_model, create_data_generators, DATASET_PATH, IMG_SIZE
+from utils import preprocess_image
+
+BATCH_SIZES = [1, 8, 32]
+
+
+def first_layer_macs(model):
+    """Multiply-accumulates of the first Conv2D for one image"""
+    conv = model.layers[0]
+    _, out_h, out_w, filters = conv.output.shape
+    kh, kw = conv.kernel_size
+    in_channels = conv.kernel.shape[2]
+    return out_h * out_w * filters * kh * kw * in_channels
+
+
+def sample_image_path():
+    """A real X-ray from the dataset if present, otherwise a synthetic one"""
+    test_dir = os.path.join(DATASET_PATH, 'test', 'NORMAL')
+    if os.path.isdir(test_dir):
+        for name in sorted(os.listdir(test_dir)):
+            if name.lower().endswith(('.jpg', '.jpeg', '.png')):
+                return os.path.join(test_dir, name)
+    path = 'model/benchmark_sample.jpg'
+    os.makedirs('model', exist_ok=True)
+    noise = np.random.default_rng(0).integers(0, 256, (1800, 1500), dtype=np.uint8)
+    Image.fromarray(noise, 'L').convert('RGB').save(path, quality=90)
+    return path
+
+
+def measure_decode_peak(path, input_shape):
+    """
+    Peak decode memory (KB) for one image, measured by decode_peak.py
+    A separate interpreter that never imports TensorFlow, so its import
+    high-water mark cannot hide the decode (see decode_peak.py).
+    """
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'decode_peak.py')
+    output = subprocess.run(
+        [sys.executable, script, path, *map(str, input_shape)],
+        check=True, capture_output=True, text=True
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def measure_preprocess(path, input_shape, runs):
+    """Mean preprocessing time (ms) and peak decode memory (KB)"""
+    preprocess_image(path, input_shape)
+    start = time.perf_counter()
+    for _ in range(runs):
+        preprocess_image(path, input_shape)
+    elapsed = (time.perf_counter() - start) * 1000.0 / runs
+    return elapsed, measure_decode_peak(path, input_shape)
+
+
+def measure_latency(model, batch_size, runs):
+    """Median forward-pass latency (ms) for one batch"""
+    batch = np.random.rand(batch_size, *model.input_shape[1:]).astype(np.float32)
+    model.predict(batch, batch_size=batch_size, verbose=0)
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        model.predict(batch, batch_size=batch_size, verbose=0)
+        timings.append((time.perf_counter() - start) * 1000.0)
+    return float(np.median(timings))
+
+
+def measure_accuracy(model, color_mode):
+    if not os.path.exists(DATASET_PATH):
+        return None
+    _, _, test_gen = create_data_generators(color_mode)
+    y_pred = model.predict(test_gen, verbose=0)
+    return float(np.mean((y_pred > 0.5).astype(int).flatten() == test_gen.classes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Grayscale vs RGB CNN benchmark')
+    parser.add_argument('--rgb-model', help='trained RGB model (.h5)')
+    parser.add_argument('--gray-model', help='trained grayscale model (.h5)')
+    parser.add_argument('--runs', type=int, default=20)
+    args = parser.parse_args()
+
+    variants = {
+        'rgb': (args.rgb_model, 3, 'rgb'),
+        'grayscale': (args.gray_model, 1, 'grayscale')
+    }
+    image_path = sample_image_path()
+
+    print("=" * 60)
+    print("📊 Grayscale vs RGB CNN Benchmark")
+    print("=" * 60)
+    print(f"Sample image: {image_path}\n")
+
+    results = {}
+    for name, (path, channels, color_mode) in variants.items():
+        if path:
+            model = keras.models.load_model(path)
+        else:
+            model = build_cnn_model(channels)
+        input_shape = IMG_SIZE + (channels,)
+        prep_ms, prep_kb = measure_preprocess(image_path, input_shape, args.runs)
+        results[name] = {
+            'params': model.count_params(),
+            'first_layer_macs': first_layer_macs(model),
+            'input_bytes': int(np.prod(input_shape)) * 4,
+            'preprocess_ms': prep_ms,
+            'preprocess_peak_kb': prep_kb,
+            'latency_ms': {bs: measure_latency(model, bs, args.runs) for bs in BATCH_SIZES},
+            'accuracy': measure_accuracy(model, color_mode) if path else None
+        }
+
+    rgb, gray = results['rgb'], results['grayscale']
+    rows = [
+        ('Parameters', 'params', '{:,}'),
+        ('First-layer MACs', 'first_layer_macs', '{:,}'),
+        ('Input tensor bytes', 'input_bytes', '{:,}'),
+        ('Preprocess (ms)', 'preprocess_ms', '{:.2f}'),
+        ('Decode peak RSS (KB)', 'preprocess_peak_kb', '{:.0f}')
+    ]
+    print(f"{'Metric':28s} {'RGB':>14s} {'Grayscale':>14s} {'Ratio':>8s}")
+    print("-" * 68)
+    for label, key, fmt in rows:
+        ratio = gray[key] / rgb[key] if rgb[key] else float('nan')
+        print(f"{label:28s} {fmt.format(rgb[key]):>14s} {fmt.format(gray[key]):>14s} {ratio:>7.2f}x")
+    for bs in BATCH_SIZES:
+        r, g = rgb['latency_ms'][bs], gray['latency_ms'][bs]
+        print(f"{f'Latency batch={bs} (ms)':28s} {r:>14.2f} {g:>14.2f} {g / r:>7.2f}x")
+    if rgb['accuracy'] is not None and gray['accuracy'] is not None:
+        print(f"{'Test accuracy':28s} {rgb['accuracy'] * 100:>13.2f}% {gray['accuracy'] * 100:>13.2f}%")
+    else:
+        print("\n💡 Pass --rgb-model and --gray-model (trained with COLOR_MODE=grayscale)")
+        print("   to compare test accuracy as well.")
+    print("=" * 60)
+
+
+if __name__ == '__main__':
+    main()
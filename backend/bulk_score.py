@@ -0,0 +1,270 @@
+"""
+Offline bulk scoring for large image archives
+
+Walks a directory tree, decodes images in a process pool, scores them in
+large batches and appends results to a CSV as it goes. The CSV doubles as
+the checkpoint: re-running the same command skips every file already scored
+in it, so an interrupted run resumes where it stopped. Files that failed to
+decode are retried on the next run (their earlier error row stays in the CSV).
+Only a few batches of decoded images are in flight at once, so memory stays
+bounded however far the decoders run ahead of inference. A small JSON manifest next
+to the CSV records the run settings and guards against resuming with a
+different model.
+
+Usage:
+    python bulk_score.py /data/xray_archive --output scores.csv
+    python bulk_score.py /data/xray_archive --output scores.csv --db --workers 8
+"""
+
+import argparse
+import csv
+import hashlib
+import json
+import multiprocessing
+import os
+import threading
+import time
+from datetime import datetime
+import numpy as np
+from config import Config
+from utils import decode_image, get_prediction_label, file_digest
+from rollups import update_rollups
+from response_cache import bump_data_version
+from tf_threads import configure_threads
+
+CSV_FIELDS = ['path', 'prediction', 'score', 'confidence', 'error']
+DECODE_CHUNKSIZE = 16
+
+
+def iter_images(root):
+    """Yield image paths (relative to root) in a stable order"""
+    stack = [root]
+    while stack:
+        directory = stack.pop()
+        entries = sorted(os.scandir(directory), key=lambda e: e.name, reverse=True)
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                stack.append(entry.path)
+            elif entry.name.rsplit('.', 1)[-1].lower() in Config.ALLOWED_EXTENSIONS:
+                yield os.path.relpath(entry.path, root)
+
+
+def load_finished(output_path):
+    """
+    Paths already scored in a previous run
+    A partially written last line (from a crash) is truncated away.
+    Rows with an error are not counted, so those files are retried.
+    """
+    if not os.path.exists(output_path):
+        return set()
+
+    with open(output_path, 'rb+') as f:
+        data = f.read()
+        if data and not data.endswith(b'\n'):
+            f.truncate(data.rfind(b'\n') + 1)
+
+    with open(output_path, newline='') as f:
+        return {row['path'] for row in csv.DictReader(f) if not row['error']}
+
+
+def check_manifest(manifest_path, settings):
+    """Refuse to resume a run that used a different model or root"""
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            previous = json.load(f)
+        for key in ('root', 'model_version', 'input_shape'):
+            if previous.get(key) != settings[key]:
+                raise SystemExit(
+                    f"❌ {manifest_path} was written with {key}={previous.get(key)!r}, "
+                    f"now {settings[key]!r}. Use a new --output to start a fresh run."
+                )
+
+
+def write_manifest(manifest_path, settings, counts):
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({**settings, **counts, 'updated_at': datetime.utcnow().isoformat()}, f, indent=2)
+    os.replace(tmp_path, manifest_path)
+
+
+def _decode_worker(args):
+    """Runs in the process pool: decode one image to uint8"""
+    root, rel_path, input_shape = args
+    try:
+        return rel_path, decode_image(os.path.join(root, rel_path), input_shape), None
+    except Exception as e:
+        return rel_path, None, str(e)
+
+
+def _record_id(model_version, rel_path):
+    """Deterministic _id so a resumed run never inserts the same row twice"""
+    return hashlib.sha1(f'{model_version}:{rel_path}'.encode()).hexdigest()
+
+
+def insert_rows(db, rows, model_version):
+    """Bulk insert scored rows into the predictions collection"""
+    from pymongo.errors import BulkWriteError
+
+    now = datetime.utcnow()
+    docs = [{
+        '_id': _record_id(model_version, row['path']),
+        'filename': os.path.basename(row['path']),
+        'path': row['path'],
+        'result': row['prediction'],
+        'confidence': row['confidence'],
+        'model_version': model_version,
+        'source': 'bulk',
+        'timestamp': now.isoformat()
+    } for row in rows if not row['error']]
+    if not docs:
+        return
+    try:
+        db.predictions.insert_many(docs, ordered=False)
+        inserted = docs
+    except BulkWriteError as e:
+        # Duplicate keys are rows already inserted before an interruption
+        errors = e.details.get('writeErrors', [])
+        if any(err.get('code') != 11000 for err in errors):
+            raise
+        duplicates = {err['index'] for err in errors}
+        inserted = [doc for index, doc in enumerate(docs) if index not in duplicates]
+    finally:
+        # Some records may exist even if the insert raised: invalidate caches first
+        bump_data_version()
+    update_rollups(db, [(now, doc['result'], doc['confidence']) for doc in inserted])
+
+
+def load_model(model_path):
+    """The given .h5, or whatever the registry / MODEL_PATH currently serves"""
+    if model_path:
+        import tensorflow as tf
+        return tf.keras.models.load_model(model_path), f'file-{file_digest(model_path)[:12]}'
+
+    from model_registry import ModelRegistry
+    registry = ModelRegistry()
+    registry.refresh()
+    if registry.current is None:
+        raise SystemExit("❌ No model found. Train one or pass --model.")
+    return registry.current.model, registry.current.version
+
+
+def score_batch(model, batch_paths, batch_arrays, threshold):
+    """One large forward pass; returns CSV rows"""
+    batch = np.stack(batch_arrays).astype(np.float32) / 255.0
+    scores = model.predict(batch, batch_size=len(batch), verbose=0)[:, 0]
+    rows = []
+    for path, score in zip(batch_paths, scores):
+        score = float(score)
+        confidence = score if score >= threshold else 1 - score
+        rows.append({
+            'path': path,
+            'prediction': get_prediction_label(score, confidence),
+            'score': round(score, 6),
+            'confidence': round(confidence, 6),
+            'error': ''
+        })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bulk-score an image archive')
+    parser.add_argument('root', help='directory tree of images')
+    parser.add_argument('--output', default='bulk_scores.csv', help='CSV output / checkpoint')
+    parser.add_argument('--model', help='model file (default: currently served model)')
+    parser.add_argument('--batch-size', type=int, default=256)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--threshold', type=float, default=0.5)
+    parser.add_argument('--db', action='store_true', help='also insert into MongoDB predictions')
+    args = parser.parse_args()
+
+    root = os.path.abspath(args.root)
+    manifest_path = args.output + '.manifest.json'
+
+    print("=" * 60)
+    print("🚀 Bulk Scoring")
+    print("=" * 60)
+
+    configure_threads()
+    model, model_version = load_model(args.model)
+    input_shape = tuple(model.input_shape[1:])
+    settings = {
+        'root': root,
+        'model_version': model_version,
+        'input_shape': list(input_shape),
+        'batch_size': args.batch_size
+    }
+    check_manifest(manifest_path, settings)
+
+    finished = load_finished(args.output)
+    pending = [path for path in iter_images(root) if path not in finished]
+    print(f"✅ Model {model_version}, input shape {input_shape}")
+    print(f"✅ {len(finished)} already scored, {len(pending)} to go")
+    if not pending:
+        return
+
+    db = None
+    if args.db:
+        from pymongo import MongoClient
+        db = MongoClient(Config.MONGO_URI).pneumonia_db
+
+    counts = {'processed': len(finished), 'errors': 0}
+    start = time.perf_counter()
+    new_file = not os.path.exists(args.output) or os.path.getsize(args.output) == 0
+
+    # spawn: workers import only PIL/NumPy, never the parent's TensorFlow state
+    context = multiprocessing.get_context('spawn')
+    with open(args.output, 'a', newline='') as out, \
+            context.Pool(args.workers) as pool:
+        writer = csv.DictWriter(out, fieldnames=CSV_FIELDS)
+        if new_file:
+            writer.writeheader()
+
+        def flush(batch_paths, batch_arrays, error_rows):
+            rows = list(error_rows)
+            if batch_paths:
+                rows.extend(score_batch(model, batch_paths, batch_arrays, args.threshold))
+            if db is not None:
+                insert_rows(db, rows, model_version)
+            writer.writerows(rows)
+            out.flush()
+            counts['processed'] += len(rows)
+            counts['errors'] += len(error_rows)
+            write_manifest(manifest_path, settings, counts)
+
+        # The pool's task feeder drains the job generator as fast as it can; the semaphore
+        # caps decoded-but-unscored images at about two batches plus one chunk
+        # per worker, instead of letting them pile up in the result queue
+        in_flight = threading.Semaphore(2 * args.batch_size + args.workers * DECODE_CHUNKSIZE)
+
+        def bounded_jobs():
+            for path in pending:
+                in_flight.acquire()
+                yield root, path, input_shape
+
+        batch_paths, batch_arrays, error_rows = [], [], []
+        for done, (path, array, error) in enumerate(
+                pool.imap_unordered(_decode_worker, bounded_jobs(), chunksize=DECODE_CHUNKSIZE), 1):
+            in_flight.release()
+            if error is not None:
+                error_rows.append({'path': path, 'prediction': '', 'score': '',
+                                   'confidence': '', 'error': error})
+            else:
+                batch_paths.append(path)
+                batch_arrays.append(array)
+
+            if len(batch_paths) >= args.batch_size:
+                flush(batch_paths, batch_arrays, error_rows)
+                batch_paths, batch_arrays, error_rows = [], [], []
+                rate = done / (time.perf_counter() - start)
+                print(f"  {counts['processed']} processed ({rate:.1f} img/s)")
+
+        flush(batch_paths, batch_arrays, error_rows)
+
+    elapsed = time.perf_counter() - start
+    print(f"\n✅ Scored {len(pending)} images in {elapsed:.1f}s "
+          f"({len(pending) / elapsed:.1f} img/s), {counts['errors']} errors")
+    print(f"💾 Results in {args.output}")
+
+
+if __name__ == '__main__':
+    main()
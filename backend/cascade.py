@@ -0,0 +1,308 @@
+"""
+Confidence-gated model cascade
+
+Most X-rays are clearly NORMAL or clearly PNEUMONIA, and a small CNN
+(train_model.py, or the distilled student) gets those right. With
+CASCADE_ENABLED=1 /predict runs that fast model first and only escalates
+to the served model (the VGG16 transfer model) when the fast score lands
+inside the uncertainty band [low, high] around the 0.5 threshold.
+
+The fast model's own penultimate-layer embeddings go to a separate
+similar-case index (its embedding space differs from the served model's),
+so /similar also works for images the fast model answered.
+
+The band is calibrated offline: the calibration split is scored with both
+models and the narrowest band is chosen whose cascade accuracy stays within
+--max-accuracy-drop of always using the large model. The test split then
+gets a report of escalation rate, measured per-image latency and accuracy
+for the fast model, the full model and the cascade.
+
+Usage:
+    python cascade.py calibrate --fast model/cnn_model.h5 --full model/pneumonia_model.h5
+    CASCADE_ENABLED=1 gunicorn app:app ...    # serves with model/cascade_calibration.json
+"""
+
+import argparse
+import json
+import os
+import threading
+import time
+from datetime import datetime
+import numpy as np
+from config import Config
+from embedding_index import EmbeddingIndex
+from utils import preprocess_image, file_digest
+
+DATASET_PATH = '../dataset/chest_xray'
+DEFAULT_BAND = (0.2, 0.8)
+THRESHOLD = 0.5
+
+
+def load_band():
+    """(low, high) from CASCADE_LOW/HIGH, else the calibration file, else the default"""
+    if Config.CASCADE_LOW is not None and Config.CASCADE_HIGH is not None:
+        return float(Config.CASCADE_LOW), float(Config.CASCADE_HIGH)
+    try:
+        with open(Config.CASCADE_CALIBRATION_FILE) as f:
+            calibration = json.load(f)
+        return float(calibration['low']), float(calibration['high'])
+    except (FileNotFoundError, KeyError, ValueError):
+        print(f"⚠️  No cascade calibration found, using band {DEFAULT_BAND}")
+        return DEFAULT_BAND
+
+
+def load_fast_model(path):
+    """The first-stage model, as a TFLite artifact when MODEL_FORMAT=tflite"""
+    from model_artifact import TFLiteModel, tflite_path_for
+
+    artifact = tflite_path_for(path)
+    if Config.MODEL_FORMAT == 'tflite' and os.path.exists(artifact):
+        return TFLiteModel(artifact)
+    import tensorflow as tf
+    return tf.keras.models.load_model(path)
+
+
+class Cascade:
+    """Fast model + escalation band, with per-worker escalation/latency stats"""
+
+    def __init__(self, fast_path=None, band=None):
+        self.path = fast_path or Config.CASCADE_FAST_MODEL_PATH
+        self.model = load_fast_model(self.path)
+        self.version = f'fast-{file_digest(self.path)[:12]}'
+        self.low, self.high = band or load_band()
+        self._forward = None
+        self.index = None
+        self._build_forward()
+        self.model.predict(np.zeros((1,) + self.input_shape, dtype=np.float32), verbose=0)
+        self._lock = threading.Lock()
+        self._stats = {'requests': 0, 'escalations': 0, 'fast_seconds': 0.0, 'full_seconds': 0.0}
+        print(f"✅ Cascade fast model {self.version} loaded, band [{self.low}, {self.high}]")
+
+    def _build_forward(self):
+        """(embedding, score) view of a Keras fast model, as LoadedModel does"""
+        import tensorflow as tf
+        from model_registry import find_embedding_layer
+
+        if not isinstance(self.model, tf.keras.Model):
+            return
+        layer = find_embedding_layer(self.model)
+        if layer is None:
+            return
+        try:
+            self._forward = tf.keras.Model(self.model.inputs, [layer.output, self.model.outputs[0]])
+        except Exception as e:
+            print(f"⚠️  Embeddings disabled for {self.version}: {str(e)}")
+            return
+        self.index = EmbeddingIndex(self.version, layer.units)
+
+    @property
+    def input_shape(self):
+        return tuple(self.model.input_shape[1:])
+
+    def _predict_fast(self, fast_input):
+        """Fast score, plus its embedding when available"""
+        if self._forward is None:
+            return float(self.model.predict(fast_input, verbose=0)[0][0]), None
+        embeddings, scores = self._forward.predict(fast_input, verbose=0)
+        return float(scores[0][0]), embeddings[0]
+
+    def predict(self, full, filepath, img_array):
+        """
+        Score with the fast model, escalating to `full` (a LoadedModel) when uncertain
+        img_array is the input already preprocessed for the full model.
+        Returns (score, full-model embedding or None, fast-model embedding
+        or None, details)
+        """
+        fast_input = img_array
+        if self.input_shape != full.input_shape:
+            # e.g. a grayscale fast model in front of the RGB transfer model
+            fast_input = preprocess_image(filepath, self.input_shape)
+
+        start = time.perf_counter()
+        fast_score, fast_embedding = self._predict_fast(fast_input)
+        fast_seconds = time.perf_counter() - start
+
+        score, embedding, full_seconds = fast_score, None, 0.0
+        escalated = self.low <= fast_score <= self.high
+        if escalated:
+            start = time.perf_counter()
+            prediction, embeddings = full.predict_with_embedding(img_array)
+            full_seconds = time.perf_counter() - start
+            score = float(prediction[0][0])
+            if embeddings is not None:
+                embedding = embeddings[0]
+
+        with self._lock:
+            self._stats['requests'] += 1
+            self._stats['escalations'] += int(escalated)
+            self._stats['fast_seconds'] += fast_seconds
+            self._stats['full_seconds'] += full_seconds
+
+        return score, embedding, fast_embedding, {
+            'escalated': escalated,
+            'fast_score': round(fast_score, 4),
+            'answered_by': full.version if escalated else self.version
+        }
+
+    def stats(self):
+        with self._lock:
+            s = dict(self._stats)
+        requests = s['requests']
+        return {
+            'fast_model': self.version,
+            'band': [self.low, self.high],
+            'requests': requests,
+            'escalations': s['escalations'],
+            'escalation_rate': round(s['escalations'] / requests, 4) if requests else None,
+            'mean_fast_ms': round(s['fast_seconds'] * 1000.0 / requests, 2) if requests else None,
+            'mean_total_ms': round((s['fast_seconds'] + s['full_seconds']) * 1000.0 / requests, 2)
+            if requests else None,
+            'embedding_index': self.index.stats() if self.index else None
+        }
+
+
+# ---- offline calibration ----
+
+def load_split(split, input_shape):
+    """All images of a dataset split as one float array, plus labels"""
+    from tensorflow.keras.preprocessing.image import ImageDataGenerator
+
+    generator = ImageDataGenerator(rescale=1./255).flow_from_directory(
+        os.path.join(DATASET_PATH, split),
+        target_size=input_shape[:2],
+        color_mode='grayscale' if input_shape[2] == 1 else 'rgb',
+        batch_size=64,
+        class_mode='binary',
+        shuffle=False
+    )
+    images = np.concatenate([generator[i][0] for i in range(len(generator))])
+    return images.astype(np.float32), generator.classes
+
+
+def timed_scores(model, images):
+    """Per-image scores and latencies (batch of 1, as in /predict)"""
+    model.predict(images[:1], verbose=0)
+    scores = np.empty(len(images), dtype=np.float32)
+    latencies = np.empty(len(images), dtype=np.float64)
+    for i in range(len(images)):
+        start = time.perf_counter()
+        scores[i] = model.predict(images[i:i + 1], verbose=0)[0][0]
+        latencies[i] = (time.perf_counter() - start) * 1000.0
+    return scores, latencies
+
+
+def cascade_outcome(fast_scores, full_scores, labels, low, high):
+    """Escalation mask and accuracy of the cascade for one band"""
+    escalate = (fast_scores >= low) & (fast_scores <= high)
+    final = np.where(escalate, full_scores, fast_scores)
+    accuracy = float(np.mean((final >= THRESHOLD).astype(int) == labels))
+    return escalate, accuracy
+
+
+def choose_band(fast_scores, full_scores, labels, max_accuracy_drop, step=0.01):
+    """Narrowest-escalation band whose accuracy is within max_accuracy_drop of the full model"""
+    full_accuracy = float(np.mean((full_scores >= THRESHOLD).astype(int) == labels))
+    best = None
+    for low in np.arange(0.0, THRESHOLD + step / 2, step):
+        for high in np.arange(THRESHOLD, 1.0 + step / 2, step):
+            escalate, accuracy = cascade_outcome(fast_scores, full_scores, labels, low, high)
+            if accuracy < full_accuracy - max_accuracy_drop:
+                continue
+            key = (escalate.mean(), -accuracy, high - low)
+            if best is None or key < best[0]:
+                best = (key, round(float(low), 4), round(float(high), 4))
+    return best[1], best[2]
+
+
+def summarize(name, predictions, labels, latencies, escalation_rate=None):
+    row = {
+        'model': name,
+        'accuracy': round(float(np.mean(predictions == labels)), 4),
+        'mean_latency_ms': round(float(np.mean(latencies)), 2),
+        'p95_latency_ms': round(float(np.percentile(latencies, 95)), 2)
+    }
+    if escalation_rate is not None:
+        row['escalation_rate'] = round(float(escalation_rate), 4)
+    return row
+
+
+def calibrate(fast_path, full_path, calibration_split, max_accuracy_drop, output_path):
+    import tensorflow as tf
+
+    print("=" * 60)
+    print("🚀 Cascade calibration")
+    print("=" * 60)
+    fast = tf.keras.models.load_model(fast_path)
+    full = tf.keras.models.load_model(full_path)
+    fast_shape = tuple(fast.input_shape[1:])
+    full_shape = tuple(full.input_shape[1:])
+
+    print(f"\n📏 Calibrating on '{calibration_split}'...")
+    fast_images, labels = load_split(calibration_split, fast_shape)
+    full_images = fast_images if full_shape == fast_shape else load_split(calibration_split, full_shape)[0]
+    if len(labels) < 100:
+        print(f"⚠️  Only {len(labels)} calibration images - the band will be noisy "
+              f"(consider --calibration-split test)")
+    fast_scores = fast.predict(fast_images, verbose=0).flatten()
+    full_scores = full.predict(full_images, verbose=0).flatten()
+    low, high = choose_band(fast_scores, full_scores, labels, max_accuracy_drop)
+    escalate, accuracy = cascade_outcome(fast_scores, full_scores, labels, low, high)
+    print(f"✅ Band [{low}, {high}]: escalates {escalate.mean():.1%}, accuracy {accuracy:.4f}")
+
+    print("\n⏱️  Evaluating on 'test' (per-image latency)...")
+    fast_images, labels = load_split('test', fast_shape)
+    full_images = fast_images if full_shape == fast_shape else load_split('test', full_shape)[0]
+    fast_scores, fast_ms = timed_scores(fast, fast_images)
+    full_scores, full_ms = timed_scores(full, full_images)
+    escalate, _ = cascade_outcome(fast_scores, full_scores, labels, low, high)
+    cascade_scores = np.where(escalate, full_scores, fast_scores)
+    # Cascade latency per image: fast pass, plus the full pass when escalated
+    cascade_ms = fast_ms + np.where(escalate, full_ms, 0.0)
+
+    report = {
+        'fast_model': fast_path,
+        'full_model': full_path,
+        'low': low,
+        'high': high,
+        'calibration_split': calibration_split,
+        'max_accuracy_drop': max_accuracy_drop,
+        'created_at': datetime.utcnow().isoformat(),
+        'test': [
+            summarize('fast', (fast_scores >= THRESHOLD).astype(int), labels, fast_ms),
+            summarize('full', (full_scores >= THRESHOLD).astype(int), labels, full_ms, 1.0),
+            summarize('cascade', (cascade_scores >= THRESHOLD).astype(int), labels, cascade_ms,
+                      escalate.mean())
+        ]
+    }
+    with open(output_path, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print("\n" + "=" * 60)
+    print(f"📊 Test split ({len(labels)} images), band [{low}, {high}]")
+    print("=" * 60)
+    print(f"{'Model':10s} {'Accuracy':>10s} {'Mean ms':>10s} {'p95 ms':>10s} {'Escalated':>10s}")
+    for row in report['test']:
+        escalated = f"{row['escalation_rate']:.1%}" if 'escalation_rate' in row else '-'
+        print(f"{row['model']:10s} {row['accuracy']:>10.4f} {row['mean_latency_ms']:>10.2f} "
+              f"{row['p95_latency_ms']:>10.2f} {escalated:>10s}")
+    print("=" * 60)
+    print(f"💾 Calibration saved to {output_path} - serve with CASCADE_ENABLED=1")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Calibrate the fast/full model cascade')
+    sub = parser.add_subparsers(dest='command', required=True)
+    calibrate_cmd = sub.add_parser('calibrate')
+    calibrate_cmd.add_argument('--fast', default=Config.CASCADE_FAST_MODEL_PATH)
+    calibrate_cmd.add_argument('--full', default=Config.MODEL_PATH)
+    calibrate_cmd.add_argument('--calibration-split', default='val', choices=['val', 'test'])
+    calibrate_cmd.add_argument('--max-accuracy-drop', type=float, default=0.005)
+    calibrate_cmd.add_argument('--output', default=Config.CASCADE_CALIBRATION_FILE)
+    args = parser.parse_args()
+
+    calibrate(args.fast, args.full, args.calibration_split, args.max_accuracy_drop, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -20,11 +20,104 @@ class Config:
     UPLOAD_FOLDER = 'uploads'
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg'}
+    # Header validation limits (checked before any pixel decoding)
+    ALLOWED_IMAGE_FORMATS = {'PNG', 'JPEG'}
+    ALLOWED_IMAGE_MODES = {'1', 'L', 'LA', 'I', 'I;16', 'P', 'RGB', 'RGBA', 'CMYK', 'YCbCr'}
+    MIN_IMAGE_DIMENSION = int(os.getenv('MIN_IMAGE_DIMENSION', 32))
+    MAX_IMAGE_DIMENSION = int(os.getenv('MAX_IMAGE_DIMENSION', 8192))
+    MAX_IMAGE_PIXELS = int(os.getenv('MAX_IMAGE_PIXELS', 40_000_000))
+    # Content-addressed store eviction (0 disables the limit)
+    UPLOAD_MAX_AGE_DAYS = float(os.getenv('UPLOAD_MAX_AGE_DAYS', 30))
+    UPLOAD_MAX_BYTES = int(os.getenv('UPLOAD_MAX_BYTES', 2 * 1024 * 1024 * 1024))  # 2GB
+    UPLOAD_SWEEP_INTERVAL = int(os.getenv('UPLOAD_SWEEP_INTERVAL', 3600))  # seconds
     
     # Model configuration
     MODEL_PATH = 'model/pneumonia_model.h5'
     IMG_SIZE = (128, 128)  # Match training size
     
+    # Versioned models: model/versions/<version>/pneumonia_model.h5
+    MODEL_REGISTRY_DIR = os.getenv('MODEL_REGISTRY_DIR', 'model/versions')
+    MODEL_WATCH_INTERVAL = int(os.getenv('MODEL_WATCH_INTERVAL', 10))  # seconds, 0 disables
+    SHADOW_VERSION = os.getenv('SHADOW_VERSION')  # overridden by model/versions/SHADOW
+    SHADOW_SAMPLE_RATE = float(os.getenv('SHADOW_SAMPLE_RATE', 0.1))
+    ADMIN_TOKEN = os.getenv('ADMIN_TOKEN')  # admin endpoints disabled when unset
+    
+    # Serving artifact: 'tflite' loads <model>.tflite (see model_artifact.py)
+    # when present, with memory-mapped weights shared across workers
+    MODEL_FORMAT = os.getenv('MODEL_FORMAT', 'h5')
+    TFLITE_INTERPRETERS = int(os.getenv('TFLITE_INTERPRETERS', 2))
+    TFLITE_XNNPACK = os.getenv('TFLITE_XNNPACK', '0') == '1'
+    
+    # TensorFlow CPU thread pools per process (0 = one thread per core).
+    # With several gunicorn workers, keep workers x intra-op <= cores;
+    # `python autotune.py` measures the best split for this machine
+    TF_INTRA_OP_THREADS = int(os.getenv('TF_INTRA_OP_THREADS', 0))
+    TF_INTER_OP_THREADS = int(os.getenv('TF_INTER_OP_THREADS', 0))
+    
+    # Test-time augmentation (/predict?tta=1), matching the training generator
+    TTA_TRANSFORMS = os.getenv(
+        'TTA_TRANSFORMS',
+        'identity,hflip,shift_left,shift_right,shift_up,shift_down,zoom_in,zoom_out'
+    )
+    TTA_SHIFT = float(os.getenv('TTA_SHIFT', 0.1))  # fraction of width/height
+    TTA_ZOOM = float(os.getenv('TTA_ZOOM', 0.1))
+    
+    # Ranged /stats queries (?from=&to=&granularity=hour|day)
+    STATS_MAX_BUCKETS = int(os.getenv('STATS_MAX_BUCKETS', 5000))
+    
+    # /history and /stats response cache (ETag / If-None-Match)
+    # The version file is shared by all workers on the machine
+    DATA_VERSION_FILE = os.getenv('DATA_VERSION_FILE', 'cache/data_version')
+    RESPONSE_CACHE_ENTRIES = int(os.getenv('RESPONSE_CACHE_ENTRIES', 256))
+    
     # Class labels
     CLASS_LABELS = ['NORMAL', 'PNEUMONIA']
+    
+    # Admission control (per worker process)
+    # /predict runs inference; /history and /stats get their own lane so
+    # dashboard reads are never stuck behind a burst of predictions.
+    # Queued requests hold a gunicorn thread too, and requests beyond
+    # --threads wait in gunicorn's own queue where no lane can reject them:
+    # keep in-flight + queue summed over all three lanes <= --threads
+    # (24 in Procfile; the defaults add up to 6 + 12 + 6 = 24)
+    PREDICT_MAX_INFLIGHT = int(os.getenv('PREDICT_MAX_INFLIGHT', 2))
+    PREDICT_MAX_QUEUE = int(os.getenv('PREDICT_MAX_QUEUE', 4))
+    PREDICT_QUEUE_TIMEOUT = float(os.getenv('PREDICT_QUEUE_TIMEOUT', 30))
+    READ_MAX_INFLIGHT = int(os.getenv('READ_MAX_INFLIGHT', 4))
+    READ_MAX_QUEUE = int(os.getenv('READ_MAX_QUEUE', 8))
+    READ_QUEUE_TIMEOUT = float(os.getenv('READ_QUEUE_TIMEOUT', 5))
+    EXPLAIN_MAX_INFLIGHT = int(os.getenv('EXPLAIN_MAX_INFLIGHT', 2))
+    EXPLAIN_MAX_QUEUE = int(os.getenv('EXPLAIN_MAX_QUEUE', 4))
+    EXPLAIN_QUEUE_TIMEOUT = float(os.getenv('EXPLAIN_QUEUE_TIMEOUT', 30))
+    
+    # Grad-CAM explanations
+    GRADCAM_MAX_BATCH = int(os.getenv('GRADCAM_MAX_BATCH', 8))
+    GRADCAM_MAX_WAIT = float(os.getenv('GRADCAM_MAX_WAIT', 0.02))  # seconds to fill a batch
+    GRADCAM_ALPHA = float(os.getenv('GRADCAM_ALPHA', 0.4))
+    GRADCAM_MAX_SIDE = int(os.getenv('GRADCAM_MAX_SIDE', 512))
+    GRADCAM_CACHE_DIR = os.getenv('GRADCAM_CACHE_DIR', 'cache/gradcam')
+    # Overlay cache budget, enforced by the upload sweeper (0 disables a limit)
+    GRADCAM_CACHE_MAX_AGE_DAYS = float(os.getenv('GRADCAM_CACHE_MAX_AGE_DAYS', 7))
+    GRADCAM_CACHE_MAX_BYTES = int(os.getenv('GRADCAM_CACHE_MAX_BYTES', 512 * 1024 * 1024))  # 512MB
+
+    # Similar-case retrieval (penultimate-layer embeddings, one index per model version)
+    EMBEDDING_INDEX_DIR = os.getenv('EMBEDDING_INDEX_DIR', 'cache/embeddings')
+    SIMILAR_IVF_THRESHOLD = int(os.getenv('SIMILAR_IVF_THRESHOLD', 50000))  # brute force below this
+    SIMILAR_NPROBE = int(os.getenv('SIMILAR_NPROBE', 8))
+    SIMILAR_MAX_K = int(os.getenv('SIMILAR_MAX_K', 50))
+
+    # Near-duplicate reuse (perceptual hash, one index per model version)
+    # /predict?reuse=1 returns the earlier result for an image within
+    # PHASH_MAX_DISTANCE bits (of 64); NEAR_DUPLICATE_REUSE sets the default
+    PHASH_INDEX_DIR = os.getenv('PHASH_INDEX_DIR', 'cache/phash')
+    PHASH_MAX_DISTANCE = int(os.getenv('PHASH_MAX_DISTANCE', 4))
+    NEAR_DUPLICATE_REUSE = os.getenv('NEAR_DUPLICATE_REUSE', '0') == '1'
+
+    # Cascade: fast CNN first, the served model only inside the uncertainty band
+    # (band from `python cascade.py calibrate`, or CASCADE_LOW/CASCADE_HIGH)
+    CASCADE_ENABLED = os.getenv('CASCADE_ENABLED', '0') == '1'
+    CASCADE_FAST_MODEL_PATH = os.getenv('CASCADE_FAST_MODEL_PATH', 'model/cnn_model.h5')
+    CASCADE_CALIBRATION_FILE = os.getenv('CASCADE_CALIBRATION_FILE', 'model/cascade_calibration.json')
+    CASCADE_LOW = os.getenv('CASCADE_LOW')
+    CASCADE_HIGH = os.getenv('CASCADE_HIGH')
 
@@ -0,0 +1,52 @@
+"""
+Peak memory of one preprocess_image() call, measured in its own process
+
+Run by benchmark_grayscale.py as a fresh interpreter that imports only
+PIL/NumPy/utils, so nothing heavier (TensorFlow, matplotlib) sets the
+high-water mark. On Linux the peak RSS counter is reset right before the
+decode (/proc/self/clear_refs), so the result is what the decode itself
+adds, including Pillow's C-side buffers. Elsewhere it falls back to the
+rise of ru_maxrss over the post-import baseline.
+
+Usage:
+    python decode_peak.py <image> <height> <width> <channels>    # prints KB
+"""
+
+import resource
+import sys
+from PIL import Image
+from utils import preprocess_image
+
+
+def _status_kb(field):
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return float(line.split()[1])
+    return None
+
+
+def _max_rss_kb():
+    """ru_maxrss is bytes on macOS, KB on Linux"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024.0 if sys.platform == 'darwin' else float(peak)
+
+
+def decode_peak_kb(path, input_shape):
+    """KB the peak RSS rises above the pre-decode RSS during one preprocess"""
+    Image.init()  # load the format plugins before measuring
+    try:
+        before = _status_kb('VmRSS')
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')  # reset VmHWM to the current RSS
+    except OSError:
+        before = _max_rss_kb()
+        preprocess_image(path, input_shape)
+        return max(0.0, _max_rss_kb() - before)
+    preprocess_image(path, input_shape)
+    return max(0.0, _status_kb('VmHWM') - before)
+
+
+if __name__ == '__main__':
+    image_path, height, width, channels = sys.argv[1], *map(int, sys.argv[2:5])
+    print(decode_peak_kb(image_path, (height, width, channels)))
@@ -0,0 +1,316 @@
+"""
+Embedding index for similar-case retrieval
+
+/predict already computes the 128-unit penultimate Dense layer of both
+architectures; that activation is kept as the image's embedding and
+appended to an on-disk index, one per model version:
+
+index/<model_version>/records.bin
+    fixed-size records: sha256 digest (32 bytes), label (uint8),
+    score (float32), embedding (float16 x dim)
+
+Appends are single write() calls under an flock, so every gunicorn worker
+can add to the same file. Readers memory-map it and pick up new rows by
+checking the file size.
+
+Search is cosine similarity:
+- brute force (chunked, vectorized) while the index is small
+- an IVF partition (k-means centroids, probe the nearest few lists) once
+  it grows past Config.SIMILAR_IVF_THRESHOLD; rows added since the last
+  build are searched brute force until the partition is rebuilt
+
+Partitions are built on a background thread and swapped in when done, so
+searches never wait on k-means; until then they use the previous
+partition (or brute force) as before.
+
+Usage:
+    python embedding_index.py benchmark --n 200000    # recall/latency, brute force vs IVF
+"""
+
+import argparse
+import os
+import tempfile
+import threading
+import time
+import numpy as np
+from config import Config
+
+try:
+    import fcntl
+except ImportError:  # Windows - appends are not locked across processes
+    fcntl = None
+
+RECORDS_FILE = 'records.bin'
+SEARCH_CHUNK = 65536
+
+
+def record_dtype(dim):
+    return np.dtype([
+        ('digest', 'u1', (32,)),
+        ('label', 'u1'),
+        ('score', '<f4'),
+        ('embedding', '<f2', (dim,))
+    ])
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class IVFPartition:
+    """Inverted-file partition of unit vectors into k-means cells"""
+
+    def __init__(self, vectors, nlist, iterations=10, sample_size=20000, seed=0):
+        rng = np.random.default_rng(seed)
+        n = len(vectors)
+        sample = vectors[rng.choice(n, size=min(n, sample_size), replace=False)].astype(np.float32)
+        sample = _normalize(sample)
+
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)]
+        for _ in range(iterations):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            counts = np.bincount(assignment, minlength=nlist)
+            empty = counts == 0
+            sums[empty] = centroids[empty]
+            centroids = _normalize(sums)
+
+        assignment = np.empty(n, dtype=np.int32)
+        for start in range(0, n, SEARCH_CHUNK):
+            chunk = _normalize(vectors[start:start + SEARCH_CHUNK].astype(np.float32))
+            assignment[start:start + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+
+        self.centroids = centroids
+        self.order = np.argsort(assignment, kind='stable')
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=nlist))])
+        self.size = n
+
+    def candidates(self, query, nprobe):
+        """Row ids in the nprobe cells closest to the (unit) query"""
+        nprobe = min(nprobe, len(self.centroids))
+        cells = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+        return np.concatenate([self.order[self.offsets[c]:self.offsets[c + 1]] for c in cells])
+
+
+class EmbeddingIndex:
+    """Append-only embedding store + top-k cosine search for one model version"""
+
+    def __init__(self, model_version, dim, root=None):
+        self.dim = dim
+        self.dtype = record_dtype(dim)
+        self.directory = os.path.join(root or Config.EMBEDDING_INDEX_DIR, model_version)
+        self.path = os.path.join(self.directory, RECORDS_FILE)
+        self._lock = threading.Lock()
+        self._count = 0
+        self._records = None
+        self._inv_norms = np.zeros(0, dtype=np.float32)
+        self._digest_rows = {}
+        self._ivf = None
+        self._build_thread = None
+
+    # ---- writing ----
+
+    def add(self, digest, label, score, embedding):
+        """Append one embedding (digest is the image's sha256 hex)"""
+        record = np.zeros(1, dtype=self.dtype)
+        record['digest'] = np.frombuffer(bytes.fromhex(digest), dtype=np.uint8)
+        record['label'] = Config.CLASS_LABELS.index(label)
+        record['score'] = score
+        record['embedding'] = np.asarray(embedding, dtype=np.float16)
+
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.path, 'ab') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.write(record.tobytes())
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    # ---- reading ----
+
+    def _refresh(self):
+        """Map rows appended since the last call (by any process)"""
+        try:
+            count = os.path.getsize(self.path) // self.dtype.itemsize
+        except FileNotFoundError:
+            return
+        if count == self._count:
+            return
+
+        records = np.memmap(self.path, dtype=self.dtype, mode='r', shape=(count,))
+        new = records[self._count:count]
+        embeddings = new['embedding'].astype(np.float32)
+        inv = 1.0 / np.maximum(np.linalg.norm(embeddings, axis=1), 1e-12)
+        self._inv_norms = np.concatenate([self._inv_norms, inv.astype(np.float32)])
+        for offset, digest in enumerate(new['digest']):
+            self._digest_rows[digest.tobytes()] = self._count + offset
+        self._records = records
+        self._count = count
+
+        threshold = Config.SIMILAR_IVF_THRESHOLD
+        building = self._build_thread is not None and self._build_thread.is_alive()
+        if (count >= threshold and not building
+                and (self._ivf is None or count >= 2 * self._ivf.size)):
+            self._build_thread = threading.Thread(
+                target=self._build_ivf, args=(records,), name='ivf-build', daemon=True
+            )
+            self._build_thread.start()
+
+    def _build_ivf(self, records):
+        """Partition a snapshot of the rows without holding the lock, then swap it in"""
+        try:
+            count = len(records)
+            nlist = min(count, int(np.clip(np.sqrt(count), 16, 4096)))
+            ivf = IVFPartition(records['embedding'], nlist)
+        except Exception as e:
+            print(f"Error building embedding IVF: {str(e)}")
+            return
+        with self._lock:
+            if self._ivf is None or ivf.size > self._ivf.size:
+                self._ivf = ivf
+
+    def __len__(self):
+        with self._lock:
+            self._refresh()
+            return self._count
+
+    def get_embedding(self, digest):
+        with self._lock:
+            self._refresh()
+            row = self._digest_rows.get(bytes.fromhex(digest))
+            if row is None:
+                return None
+            return self._records[row]['embedding'].astype(np.float32)
+
+    def _scores(self, rows, query):
+        """Cosine similarity for the given row ids (or a slice)"""
+        embeddings = self._records['embedding'][rows].astype(np.float32)
+        return (embeddings @ query) * self._inv_norms[rows]
+
+    def search(self, query, k=5, exclude_digest=None, nprobe=None):
+        """
+        Top-k most similar stored cases
+        Returns a list of {image_digest, similarity, prediction, score}
+        """
+        query = _normalize(np.asarray(query, dtype=np.float32))
+        nprobe = nprobe or Config.SIMILAR_NPROBE
+        exclude = bytes.fromhex(exclude_digest) if exclude_digest else None
+
+        with self._lock:
+            self._refresh()
+            if self._count == 0:
+                return []
+
+            # Fetch extra candidates: the same image may be stored more than once
+            want = min(self._count, 2 * k + 1)
+            if self._ivf is not None:
+                rows = np.concatenate([
+                    self._ivf.candidates(query, nprobe),
+                    np.arange(self._ivf.size, self._count)
+                ])
+                scores = self._scores(rows, query)
+            else:
+                rows = np.arange(self._count)
+                scores = np.concatenate([
+                    self._scores(slice(start, start + SEARCH_CHUNK), query)
+                    for start in range(0, self._count, SEARCH_CHUNK)
+                ])
+
+            want = min(want, len(scores))
+            if want == 0:
+                return []
+            top = np.argpartition(-scores, want - 1)[:want]
+            top = top[np.argsort(-scores[top])]
+
+            results, seen = [], set()
+            for index in top:
+                record = self._records[rows[index]]
+                digest = record['digest'].tobytes()
+                if digest == exclude or digest in seen:
+                    continue
+                seen.add(digest)
+                results.append({
+                    'image_digest': digest.hex(),
+                    'similarity': round(float(scores[index]), 4),
+                    'prediction': Config.CLASS_LABELS[int(record['label'])],
+                    'score': round(float(record['score']), 4)
+                })
+                if len(results) == k:
+                    break
+            return results
+
+    def stats(self):
+        with self._lock:
+            self._refresh()
+            building = self._build_thread is not None and self._build_thread.is_alive()
+            return {
+                'size': self._count,
+                'mode': 'ivf' if self._ivf is not None else 'brute_force',
+                'ivf_lists': len(self._ivf.centroids) if self._ivf is not None else None,
+                'ivf_building': building
+            }
+
+
+def benchmark(n, dim, queries, k):
+    """Recall@k and latency of IVF vs exact brute force on clustered synthetic data"""
+    rng = np.random.default_rng(0)
+    centers = rng.normal(size=(max(8, n // 500), dim)).astype(np.float32)
+    data = centers[rng.integers(0, len(centers), n)] + 0.5 * rng.normal(size=(n, dim)).astype(np.float32)
+    data = np.maximum(data, 0)  # ReLU activations are non-negative
+
+    with tempfile.TemporaryDirectory() as root:
+        index = EmbeddingIndex('benchmark', dim, root=root)
+        records = np.zeros(n, dtype=index.dtype)
+        records['digest'][:, 24:] = np.arange(n, dtype='>u8').view(np.uint8).reshape(n, 8)
+        records['embedding'] = data.astype(np.float16)
+        os.makedirs(index.directory)
+        records.tofile(index.path)
+
+        query_rows = rng.choice(n, size=queries, replace=False)
+        query_vectors = data[query_rows] + 0.05 * rng.normal(size=(queries, dim)).astype(np.float32)
+
+        # Exact results (IVF disabled)
+        threshold = Config.SIMILAR_IVF_THRESHOLD
+        Config.SIMILAR_IVF_THRESHOLD = n + 1
+        len(index)
+        start = time.perf_counter()
+        exact = [{r['image_digest'] for r in index.search(q, k)} for q in query_vectors]
+        brute_ms = (time.perf_counter() - start) * 1000.0 / queries
+
+        Config.SIMILAR_IVF_THRESHOLD = 0
+        ivf_index = EmbeddingIndex('benchmark', dim, root=root)
+        start = time.perf_counter()
+        len(ivf_index)
+        ivf_index._build_thread.join()
+        build_s = time.perf_counter() - start
+        Config.SIMILAR_IVF_THRESHOLD = threshold
+
+        print("=" * 60)
+        print(f"📊 Similar-case search: n={n:,}, dim={dim}, k={k}, {queries} queries")
+        print("=" * 60)
+        print(f"Brute force:  {brute_ms:8.2f} ms/query   recall@{k} = 1.000")
+        print(f"IVF build:    {build_s:8.2f} s ({len(ivf_index._ivf.centroids)} lists)")
+        for nprobe in (1, 4, 8, 16, 32):
+            start = time.perf_counter()
+            found = [{r['image_digest'] for r in ivf_index.search(q, k, nprobe=nprobe)}
+                     for q in query_vectors]
+            ivf_ms = (time.perf_counter() - start) * 1000.0 / queries
+            recall = np.mean([len(a & b) / k for a, b in zip(exact, found)])
+            print(f"IVF nprobe={nprobe:<3d} {ivf_ms:8.2f} ms/query   recall@{k} = {recall:.3f}")
+        print("=" * 60)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Embedding index tools')
+    sub = parser.add_subparsers(dest='command', required=True)
+    bench_cmd = sub.add_parser('benchmark')
+    bench_cmd.add_argument('--n', type=int, default=100000)
+    bench_cmd.add_argument('--dim', type=int, default=128)
+    bench_cmd.add_argument('--queries', type=int, default=200)
+    bench_cmd.add_argument('--k', type=int, default=10)
+    args = parser.parse_args()
+    benchmark(args.n, args.dim, args.queries, args.k)
@@ -0,0 +1,268 @@
+"""
+Grad-CAM explanations for the pneumonia classifier
+
+Works with both training architectures:
+- build_cnn_model (plain Sequential CNN)
+- build_transfer_learning_model (Sequential wrapping a VGG16 base)
+Nested sub-models are flattened into one layer chain so the last Conv2D can
+be found and its activations/gradients captured in a single pass.
+
+Requests are coalesced by a background thread so several explanations share
+one batched forward/backward pass, and rendered overlays are cached on disk
+by image digest and model version. The cache is kept within an age/size
+budget, and versions no longer served are dropped, by HeatmapCache.sweep().
+"""
+
+import base64
+import io
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+import numpy as np
+import tensorflow as tf
+from PIL import Image, PngImagePlugin
+from config import Config
+from utils import to_8bit
+
+
+def flatten_layers(model):
+    """Expand nested models (e.g. the VGG16 base) into one list of layers"""
+    flat = []
+    for layer in model.layers:
+        if isinstance(layer, tf.keras.layers.InputLayer):
+            continue
+        if isinstance(layer, tf.keras.Model):
+            flat.extend(flatten_layers(layer))
+        else:
+            flat.append(layer)
+    return flat
+
+
+def find_last_conv(layers):
+    """Index of the last Conv2D layer in a flattened chain"""
+    for index in range(len(layers) - 1, -1, -1):
+        if isinstance(layers[index], tf.keras.layers.Conv2D):
+            return index
+    raise ValueError('Model has no Conv2D layer to explain')
+
+
+class GradCamExplainer:
+    """
+    Batched Grad-CAM over a sequential model
+    explain() blocks until the batch containing the request has been computed
+    """
+
+    def __init__(self, model, max_batch=None, max_wait=None, threshold=0.5):
+        self.layers = flatten_layers(model)
+        self.conv_index = find_last_conv(self.layers)
+        self.max_batch = max_batch or Config.GRADCAM_MAX_BATCH
+        self.max_wait = Config.GRADCAM_MAX_WAIT if max_wait is None else max_wait
+        self.threshold = threshold
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='gradcam-batcher', daemon=True)
+        self._thread.start()
+
+    def compute(self, batch):
+        """
+        Grad-CAM for a (N, H, W, C) batch with respect to the predicted class
+        Returns (heatmaps (N, h, w) in [0, 1], scores (N,))
+        """
+        x = tf.convert_to_tensor(batch, dtype=tf.float32)
+        with tf.GradientTape() as tape:
+            conv = x
+            for layer in self.layers[:self.conv_index + 1]:
+                conv = layer(conv, training=False)
+            tape.watch(conv)
+            out = conv
+            for layer in self.layers[self.conv_index + 1:]:
+                out = layer(out, training=False)
+            scores = out[:, 0]
+            # Explain whichever class was predicted for each image.
+            # Samples are independent in inference mode, so the gradient of
+            # the sum gives every sample its own gradient.
+            target = tf.where(scores >= self.threshold, scores, 1.0 - scores)
+            total = tf.reduce_sum(target)
+
+        grads = tape.gradient(total, conv)
+        weights = tf.reduce_mean(grads, axis=(1, 2))
+        cam = tf.nn.relu(tf.reduce_sum(conv * weights[:, None, None, :], axis=-1))
+        cam = cam / (tf.reduce_max(cam, axis=(1, 2), keepdims=True) + 1e-8)
+        return cam.numpy(), scores.numpy()
+
+    def explain(self, img_array, timeout=None):
+        """Queue one preprocessed (1, H, W, C) image and wait for its result"""
+        future = Future()
+        self._queue.put((img_array[0], future))
+        return future.result(timeout=timeout)
+
+    def close(self):
+        """Stop the batcher thread once already-queued requests are done"""
+        self._queue.put(None)
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            items = [first]
+            deadline = time.monotonic() + self.max_wait
+            while len(items) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    # Finish this batch, then stop
+                    self._queue.put(None)
+                    break
+                items.append(item)
+
+            try:
+                heatmaps, scores = self.compute(np.stack([item[0] for item in items]))
+                for (_, future), heatmap, score in zip(items, heatmaps, scores):
+                    future.set_result((heatmap, float(score)))
+            except Exception as e:
+                for _, future in items:
+                    future.set_exception(e)
+
+
+def _jet(values):
+    """Map [0, 1] values to an RGB jet colormap (uint8)"""
+    four = 4.0 * values
+    rgb = np.stack([
+        np.clip(1.5 - np.abs(four - 3.0), 0, 1),
+        np.clip(1.5 - np.abs(four - 2.0), 0, 1),
+        np.clip(1.5 - np.abs(four - 1.0), 0, 1)
+    ], axis=-1)
+    return (rgb * 255).astype(np.uint8)
+
+
+def render_overlay(image_path, heatmap, score, alpha=None, max_side=None):
+    """
+    Blend a heatmap over the original X-ray
+    Returns PNG bytes with the model score stored in a text chunk
+    """
+    if alpha is None:
+        alpha = Config.GRADCAM_ALPHA
+    if max_side is None:
+        max_side = Config.GRADCAM_MAX_SIDE
+
+    with Image.open(image_path) as img:
+        img.draft('RGB', (max_side, max_side))
+        base = to_8bit(img).convert('RGB')
+    base.thumbnail((max_side, max_side))
+
+    heat = Image.fromarray((heatmap * 255).astype(np.uint8)).resize(base.size, Image.BILINEAR)
+    colored = Image.fromarray(_jet(np.asarray(heat) / 255.0))
+    overlay = Image.blend(base, colored, alpha)
+
+    info = PngImagePlugin.PngInfo()
+    info.add_text('score', repr(float(score)))
+
+    buffer = io.BytesIO()
+    overlay.save(buffer, format='PNG', pnginfo=info)
+    return buffer.getvalue()
+
+
+def to_data_url(png_bytes):
+    """Encode PNG bytes for embedding in a JSON response"""
+    return 'data:image/png;base64,' + base64.b64encode(png_bytes).decode('ascii')
+
+
+class HeatmapCache:
+    """
+    On-disk cache of rendered overlays keyed by (model version, image digest)
+    Shared by all worker processes. Best-effort: a failed write only means
+    the overlay is rendered again next time.
+    """
+
+    def __init__(self, root=None):
+        self.root = root or Config.GRADCAM_CACHE_DIR
+
+    def _path(self, digest, model_version):
+        return os.path.join(self.root, model_version, digest[:2], f'{digest}.png')
+
+    def get(self, digest, model_version):
+        """Returns (png_bytes, score) or None"""
+        path = self._path(digest, model_version)
+        try:
+            with open(path, 'rb') as f:
+                png_bytes = f.read()
+            os.utime(path)  # recently used, for sweep()
+        except FileNotFoundError:
+            return None
+        # Header-only parse: text chunks precede the pixel data
+        with Image.open(io.BytesIO(png_bytes)) as img:
+            score = img.info.get('score')
+        if score is None:
+            return None
+        return png_bytes, float(score)
+
+    def put(self, digest, model_version, png_bytes):
+        path = self._path(digest, model_version)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(png_bytes)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            # e.g. sweep() removed the version directory in between
+            print(f"Error caching heatmap: {str(e)}")
+
+    def sweep(self, keep_versions, max_age_days=None, max_bytes=None):
+        """
+        Drop the directories of versions not in keep_versions, then overlays
+        older than max_age_days, then the least recently used ones until the
+        cache fits in max_bytes.
+        Returns a summary dict.
+        """
+        if max_age_days is None:
+            max_age_days = Config.GRADCAM_CACHE_MAX_AGE_DAYS
+        if max_bytes is None:
+            max_bytes = Config.GRADCAM_CACHE_MAX_BYTES
+        try:
+            versions = os.listdir(self.root)
+        except FileNotFoundError:
+            return {'versions_removed': 0, 'evicted': 0, 'remaining_bytes': 0}
+
+        versions_removed = 0
+        files = []
+        for version in versions:
+            directory = os.path.join(self.root, version)
+            if version not in keep_versions:
+                shutil.rmtree(directory, ignore_errors=True)
+                versions_removed += 1
+                continue
+            for dirpath, _, names in os.walk(directory):
+                for name in names:
+                    path = os.path.join(dirpath, name)
+                    try:
+                        st = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    files.append((st.st_mtime, st.st_size, path))
+
+        files.sort()
+        cutoff = time.time() - max_age_days * 86400
+        total = sum(size for _, size, _ in files)
+        evicted = 0
+        for mtime, size, path in files:
+            expired = max_age_days > 0 and mtime < cutoff
+            if not expired and not (max_bytes > 0 and total > max_bytes):
+                break
+            try:
+                os.remove(path)
+                evicted += 1
+            except FileNotFoundError:
+                pass
+            total -= size
+
+        return {'versions_removed': versions_removed, 'evicted': evicted, 'remaining_bytes': total}
@@ -0,0 +1,231 @@
+"""
+Fast-loading serving artifact (TFLite flatbuffer with memory-mapped weights)
+
+`tf.keras.models.load_model` parses HDF5 and rebuilds the Keras graph on
+every worker start, and each worker ends up with a private copy of the
+weights. The exported .tflite file is instead memory-mapped read-only by
+the interpreter: loading takes milliseconds, and the weights live once in
+the OS page cache no matter how many gunicorn workers map them.
+
+The interpreter comes from ai_edge_litert (LiteRT) when it is installed;
+tf.lite.Interpreter is deprecated and warns on every construction in TF
+2.20, so it is only the fallback.
+
+The XNNPACK delegate is disabled by default because it repacks weights into
+private memory; set TFLITE_XNNPACK=1 to trade memory sharing for speed.
+
+Usage:
+    python model_artifact.py export model/pneumonia_model.h5      # writes model/pneumonia_model.tflite
+    python model_artifact.py benchmark model/pneumonia_model.h5 --workers 4
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import time
+import numpy as np
+from config import Config
+
+
+def tflite_path_for(model_path):
+    """Serving artifact that sits next to a .h5 model"""
+    return os.path.splitext(model_path)[0] + '.tflite'
+
+
+def export_tflite(model_path, output_path=None):
+    """Convert a Keras .h5 model to a float32 TFLite flatbuffer"""
+    import tensorflow as tf
+
+    output_path = output_path or tflite_path_for(model_path)
+    model = tf.keras.models.load_model(model_path)
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    flatbuffer = converter.convert()
+
+    tmp_path = output_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(flatbuffer)
+    os.replace(tmp_path, output_path)
+    return output_path
+
+
+def interpreter_api():
+    """(Interpreter, OpResolverType) from LiteRT, falling back to tf.lite"""
+    try:
+        from ai_edge_litert.interpreter import Interpreter, OpResolverType
+    except ImportError:
+        import tensorflow as tf
+        Interpreter, OpResolverType = tf.lite.Interpreter, tf.lite.experimental.OpResolverType
+    return Interpreter, OpResolverType
+
+
+class TFLiteModel:
+    """
+    Keras-like predict() over a memory-mapped TFLite model
+    A small pool of interpreters serves concurrent requests; they all map
+    the same file, so extra interpreters cost activations, not weights.
+    """
+
+    def __init__(self, path, interpreters=None, num_threads=None, use_xnnpack=None):
+        Interpreter, OpResolverType = interpreter_api()
+
+        interpreters = interpreters or Config.TFLITE_INTERPRETERS
+        num_threads = num_threads or Config.TF_INTRA_OP_THREADS or None
+        use_xnnpack = Config.TFLITE_XNNPACK if use_xnnpack is None else use_xnnpack
+        resolver = (OpResolverType.AUTO if use_xnnpack
+                    else OpResolverType.BUILTIN_WITHOUT_DEFAULT_DELEGATES)
+
+        self.path = path
+        self._pool = queue.Queue()
+        for _ in range(max(1, interpreters)):
+            interpreter = Interpreter(
+                model_path=path,
+                num_threads=num_threads,
+                experimental_op_resolver_type=resolver
+            )
+            interpreter.allocate_tensors()
+            self._pool.put(interpreter)
+
+        shape = interpreter.get_input_details()[0]['shape']
+        self.input_shape = (None,) + tuple(int(dim) for dim in shape[1:])
+
+    def predict(self, x, batch_size=None, verbose=0):
+        """Same call signature as keras Model.predict for the arguments we use"""
+        x = np.ascontiguousarray(x, dtype=np.float32)
+        interpreter = self._pool.get()
+        try:
+            input_details = interpreter.get_input_details()[0]
+            if tuple(input_details['shape']) != x.shape:
+                interpreter.resize_tensor_input(input_details['index'], x.shape)
+                interpreter.allocate_tensors()
+            interpreter.set_tensor(input_details['index'], x)
+            interpreter.invoke()
+            output_index = interpreter.get_output_details()[0]['index']
+            return interpreter.get_tensor(output_index).copy()
+        finally:
+            self._pool.put(interpreter)
+
+
+def _memory_kb():
+    """Rss/Pss/private memory of this process from /proc (Linux)"""
+    fields = {}
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0].endswith(':') and parts[1].isdigit():
+                    fields[parts[0][:-1]] = int(parts[1])
+    except FileNotFoundError:
+        import resource
+        return {'rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+    return {
+        'rss_kb': fields.get('Rss'),
+        'pss_kb': fields.get('Pss'),
+        'private_kb': fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0)
+    }
+
+
+def _probe(fmt, path, barrier, results):
+    """Benchmark worker: import, load, first inference, then report memory"""
+    # TFLite workers need only the interpreter runtime (no TensorFlow with LiteRT)
+    start = time.perf_counter()
+    if fmt == 'h5':
+        import tensorflow as tf
+    else:
+        interpreter_api()
+    import_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    if fmt == 'h5':
+        model = tf.keras.models.load_model(path)
+    else:
+        model = TFLiteModel(path, interpreters=1)
+    load_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    model.predict(np.zeros((1,) + tuple(model.input_shape[1:]), dtype=np.float32), verbose=0)
+    first_s = time.perf_counter() - start
+
+    # Measure while every worker has the model loaded, so shared pages count once
+    barrier.wait()
+    results.put({'import_s': import_s, 'load_s': load_s, 'first_predict_s': first_s, **_memory_kb()})
+    barrier.wait()
+
+
+def benchmark(model_path, workers):
+    """Load each format in `workers` concurrent processes and compare"""
+    tflite_path = tflite_path_for(model_path)
+    if not os.path.exists(tflite_path):
+        print(f"📦 Exporting {tflite_path} first...")
+        export_tflite(model_path, tflite_path)
+
+    context = multiprocessing.get_context('spawn')
+    summary = {}
+    for fmt, path in (('h5', model_path), ('tflite', tflite_path)):
+        barrier = context.Barrier(workers)
+        results = context.Queue()
+        processes = [context.Process(target=_probe, args=(fmt, path, barrier, results))
+                     for _ in range(workers)]
+        for process in processes:
+            process.start()
+        rows = [results.get() for _ in range(workers)]
+        for process in processes:
+            process.join()
+
+        summary[fmt] = {
+            key: float(np.mean([row[key] for row in rows if row.get(key) is not None]))
+            for key in rows[0] if any(row.get(key) is not None for row in rows)
+        }
+        summary[fmt]['file_mb'] = os.path.getsize(path) / (1024 * 1024)
+
+    print("\n" + "=" * 60)
+    print(f"📊 Model load benchmark ({workers} concurrent workers, per-worker means)")
+    print("=" * 60)
+    labels = [
+        ('file_mb', 'File size (MB)', '{:.2f}'),
+        ('import_s', 'TF import (s)', '{:.2f}'),
+        ('load_s', 'Model load (s)', '{:.3f}'),
+        ('first_predict_s', 'First predict (s)', '{:.3f}'),
+        ('rss_kb', 'RSS (MB)', None),
+        ('pss_kb', 'PSS (MB, shared split)', None),
+        ('private_kb', 'Private (MB)', None)
+    ]
+    print(f"{'Metric':26s} {'h5':>12s} {'tflite':>12s}")
+    for key, label, fmt in labels:
+        if key not in summary['h5'] or key not in summary['tflite']:
+            continue
+        values = [summary[f][key] for f in ('h5', 'tflite')]
+        if fmt is None:
+            values = [v / 1024.0 for v in values]
+            fmt = '{:.1f}'
+        print(f"{label:26s} {fmt.format(values[0]):>12s} {fmt.format(values[1]):>12s}")
+    print("=" * 60)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export / benchmark the serving artifact')
+    sub = parser.add_subparsers(dest='command', required=True)
+    export_cmd = sub.add_parser('export')
+    export_cmd.add_argument('model', help='Keras .h5 model')
+    export_cmd.add_argument('--output')
+    bench_cmd = sub.add_parser('benchmark')
+    bench_cmd.add_argument('model', help='Keras .h5 model')
+    bench_cmd.add_argument('--workers', type=int, default=4)
+    bench_cmd.add_argument('--json', help='also write the summary to this file')
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        path = export_tflite(args.model, args.output)
+        print(f"✅ Exported {path} ({os.path.getsize(path) / (1024 * 1024):.2f} MB)")
+        print("   Serve it with MODEL_FORMAT=tflite")
+    else:
+        summary = benchmark(args.model, args.workers)
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(summary, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
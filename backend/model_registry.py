@@ -0,0 +1,401 @@
+"""
+Versioned model registry with hot reload and shadow inference
+
+Layout:
+model/versions/
+├── 20250101-120000/pneumonia_model.h5
+├── 20250108-093000/pneumonia_model.h5
+├── CURRENT      # version served to clients
+└── SHADOW       # optional candidate scored on sampled live traffic
+
+Every worker runs a watcher thread that polls the pointer files. When
+CURRENT changes, the new version is loaded and warmed in the background and
+then swapped in with a single reference assignment, so requests in flight
+keep using the model they started with and nobody pays the cold start.
+Without a registry the legacy Config.MODEL_PATH is served as before.
+
+Usage:
+    python model_registry.py list
+    python model_registry.py publish model/pneumonia_model.h5 [--version NAME] [--promote]
+    python model_registry.py promote NAME
+    python model_registry.py shadow NAME|none
+"""
+
+import argparse
+import os
+import queue
+import random
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime
+import numpy as np
+import tensorflow as tf
+from config import Config
+from embedding_index import EmbeddingIndex
+from gradcam import GradCamExplainer
+from model_artifact import TFLiteModel, tflite_path_for
+from near_duplicates import NearDuplicateIndex
+from utils import file_digest, get_prediction_label, preprocess_image
+
+MODEL_FILENAME = 'pneumonia_model.h5'
+CURRENT_POINTER = 'CURRENT'
+SHADOW_POINTER = 'SHADOW'
+
+
+def find_embedding_layer(model):
+    """The Dense layer feeding the output unit (128 units in both architectures)"""
+    dense = [layer for layer in model.layers if isinstance(layer, tf.keras.layers.Dense)]
+    return dense[-2] if len(dense) >= 2 else None
+
+
+class LoadedModel:
+    """A loaded, warmed model plus everything derived from it"""
+
+    def __init__(self, model, version, path):
+        self.model = model
+        self.version = version
+        self.path = path
+        self.loaded_at = datetime.utcnow().isoformat()
+        self._explainer = None
+        self._explainer_lock = threading.Lock()
+        self._forward = None
+        self.index = None
+        self.near_duplicates = NearDuplicateIndex(version)
+        if isinstance(model, tf.keras.Model):
+            self._build_forward()
+
+    def _build_forward(self):
+        """Two-output view of the model: (embedding, score) from one forward pass"""
+        layer = find_embedding_layer(self.model)
+        if layer is None:
+            return
+        try:
+            self._forward = tf.keras.Model(self.model.inputs, [layer.output, self.model.outputs[0]])
+        except Exception as e:
+            print(f"⚠️  Embeddings disabled for {self.version}: {str(e)}")
+            return
+        self.index = EmbeddingIndex(self.version, layer.units)
+
+    def predict_with_embedding(self, img_array):
+        """
+        Scores plus penultimate-layer embeddings (None when unavailable,
+        e.g. for TFLite artifacts)
+        """
+        if self._forward is None:
+            return self.model.predict(img_array, verbose=0), None
+        embeddings, scores = self._forward.predict(img_array, verbose=0)
+        return scores, embeddings
+
+    @property
+    def input_shape(self):
+        return tuple(self.model.input_shape[1:])
+
+    @property
+    def explainer(self):
+        """Grad-CAM batcher, created on first use"""
+        if self._explainer is None:
+            with self._explainer_lock:
+                if self._explainer is None:
+                    keras_model = self.model
+                    if not isinstance(keras_model, tf.keras.Model):
+                        # Grad-CAM needs layers: load the Keras original on demand
+                        keras_model = tf.keras.models.load_model(self.path)
+                    self._explainer = GradCamExplainer(keras_model)
+        return self._explainer
+
+    def warmup(self):
+        """Run one dummy batch so the first real request isn't slow"""
+        self.predict_with_embedding(np.zeros((1,) + self.input_shape, dtype=np.float32))
+
+    def close(self):
+        if self._explainer is not None:
+            self._explainer.close()
+
+    def describe(self):
+        return {
+            'version': self.version,
+            'path': self.path,
+            'format': 'h5' if isinstance(self.model, tf.keras.Model) else 'tflite',
+            'loaded_at': self.loaded_at,
+            'input_shape': list(self.input_shape),
+            'embedding_index': self.index.stats() if self.index else None,
+            'near_duplicates': self.near_duplicates.stats()
+        }
+
+
+class ShadowRunner:
+    """
+    Scores a sampled fraction of live traffic with a candidate model
+    Runs on its own thread with a bounded queue; samples are dropped rather
+    than slowing down the primary response.
+    """
+
+    def __init__(self, sample_rate, max_pending=8):
+        self.sample_rate = sample_rate
+        self.candidate = None
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._lock = threading.Lock()
+        self._reset_stats()
+        self._thread = threading.Thread(target=self._run, name='shadow-inference', daemon=True)
+        self._thread.start()
+
+    def _reset_stats(self):
+        self._stats = {
+            'samples': 0,
+            'agreements': 0,
+            'dropped': 0,
+            'errors': 0,
+            'abs_score_diff_sum': 0.0,
+            'primary_latency_sum': 0.0,
+            'candidate_latency_sum': 0.0
+        }
+
+    def set_candidate(self, candidate):
+        with self._lock:
+            self.candidate = candidate
+            self._reset_stats()
+
+    def maybe_submit(self, img_array, primary_score, primary_latency, filepath=None):
+        """
+        Queue a shadow comparison for this request if sampled
+        filepath lets a candidate with a different input shape (e.g. a
+        grayscale model behind an RGB one) preprocess the image itself.
+        """
+        candidate = self.candidate
+        if candidate is None or random.random() >= self.sample_rate:
+            return
+        try:
+            self._queue.put_nowait((candidate, img_array, filepath, primary_score, primary_latency))
+        except queue.Full:
+            with self._lock:
+                self._stats['dropped'] += 1
+
+    def _run(self):
+        while True:
+            candidate, img_array, filepath, primary_score, primary_latency = self._queue.get()
+            try:
+                if tuple(img_array.shape[1:]) != candidate.input_shape:
+                    img_array = preprocess_image(filepath, candidate.input_shape) if filepath else None
+                    if img_array is None:
+                        raise ValueError(f'cannot preprocess for input shape {candidate.input_shape}')
+                start = time.perf_counter()
+                score = float(candidate.model.predict(img_array, verbose=0)[0][0])
+                latency = time.perf_counter() - start
+            except Exception as e:
+                print(f"Shadow inference error: {str(e)}")
+                with self._lock:
+                    if candidate is self.candidate:
+                        self._stats['errors'] += 1
+                continue
+
+            with self._lock:
+                if candidate is not self.candidate:
+                    continue
+                agree = (get_prediction_label(score, None)
+                         == get_prediction_label(primary_score, None))
+                self._stats['samples'] += 1
+                self._stats['agreements'] += int(agree)
+                self._stats['abs_score_diff_sum'] += abs(score - primary_score)
+                self._stats['primary_latency_sum'] += primary_latency
+                self._stats['candidate_latency_sum'] += latency
+
+    def stats(self):
+        with self._lock:
+            candidate = self.candidate
+            s = dict(self._stats)
+        samples = s['samples']
+        return {
+            'candidate': candidate.version if candidate else None,
+            'sample_rate': self.sample_rate,
+            'samples': samples,
+            'dropped': s['dropped'],
+            'errors': s['errors'],
+            'agreement_rate': round(s['agreements'] / samples, 4) if samples else None,
+            'mean_abs_score_diff': round(s['abs_score_diff_sum'] / samples, 4) if samples else None,
+            'mean_primary_latency': round(s['primary_latency_sum'] / samples, 4) if samples else None,
+            'mean_candidate_latency': round(s['candidate_latency_sum'] / samples, 4) if samples else None
+        }
+
+
+class ModelRegistry:
+    """
+    Owns the served model for one worker process
+    Read `registry.current` once per request and use that object throughout.
+    """
+
+    def __init__(self, root=None, legacy_path=None):
+        self.root = root or Config.MODEL_REGISTRY_DIR
+        self.legacy_path = legacy_path or Config.MODEL_PATH
+        self.current = None
+        self.shadow = ShadowRunner(Config.SHADOW_SAMPLE_RATE)
+        self._load_lock = threading.Lock()
+        self._seen = {CURRENT_POINTER: None, SHADOW_POINTER: None}
+
+    # ---- versions and pointers ----
+
+    def model_file(self, version):
+        return os.path.join(self.root, version, MODEL_FILENAME)
+
+    def versions(self):
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(
+            name for name in os.listdir(self.root)
+            if os.path.isfile(self.model_file(name))
+        )
+
+    def read_pointer(self, name, missing=None):
+        """
+        Version a pointer file names; None if it is empty (explicitly cleared)
+        and `missing` if the file does not exist
+        """
+        try:
+            with open(os.path.join(self.root, name)) as f:
+                value = f.read().strip()
+        except FileNotFoundError:
+            return missing
+        return value or None
+
+    def write_pointer(self, name, version):
+        """Atomically point CURRENT/SHADOW at a version (None clears it)"""
+        if version is not None and version not in self.versions():
+            raise ValueError(f'Unknown model version: {version}')
+        os.makedirs(self.root, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.root)
+        with os.fdopen(fd, 'w') as f:
+            f.write(version or '')
+        os.replace(tmp_path, os.path.join(self.root, name))
+
+    # ---- loading ----
+
+    def load(self, version):
+        """Load and warm a registry version, or the legacy path if version is None"""
+        if version is None:
+            path = self.legacy_path
+            version = f'legacy-{file_digest(path)[:12]}'
+        else:
+            path = self.model_file(version)
+        start = time.perf_counter()
+        artifact = tflite_path_for(path)
+        if Config.MODEL_FORMAT == 'tflite' and os.path.exists(artifact):
+            # Memory-mapped weights, shared across workers via the page cache
+            model = TFLiteModel(artifact)
+        else:
+            model = tf.keras.models.load_model(path)
+        loaded = LoadedModel(model, version, path)
+        loaded.warmup()
+        print(f"✅ Model {version} loaded and warmed in {time.perf_counter() - start:.1f}s")
+        return loaded
+
+    def refresh(self):
+        """
+        Bring this worker in line with the pointer files
+        The swap is a single assignment after the new model is fully warmed.
+        """
+        with self._load_lock:
+            target = self.read_pointer(CURRENT_POINTER)
+            if self.current is None or target != self._seen[CURRENT_POINTER]:
+                # Mark as seen first so a broken version isn't retried every poll
+                self._seen[CURRENT_POINTER] = target
+                if target is not None or os.path.exists(self.legacy_path):
+                    previous = self.current
+                    self.current = self.load(target)
+                    if previous is not None:
+                        # Let requests still holding the old model finish
+                        threading.Timer(60, previous.close).start()
+
+            # SHADOW_VERSION is only a default: an empty SHADOW file disables shadowing
+            shadow = self.read_pointer(SHADOW_POINTER, missing=Config.SHADOW_VERSION)
+            if shadow != self._seen[SHADOW_POINTER]:
+                self._seen[SHADOW_POINTER] = shadow
+                self.shadow.set_candidate(self.load(shadow) if shadow else None)
+
+    def refresh_async(self):
+        thread = threading.Thread(target=self._safe_refresh, name='model-reload', daemon=True)
+        thread.start()
+        return thread
+
+    def _safe_refresh(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            print(f"❌ Error reloading model: {str(e)}")
+
+    def start_watcher(self, interval=None):
+        """Poll the pointer files and hot-reload on change"""
+        if interval is None:
+            interval = Config.MODEL_WATCH_INTERVAL
+        if interval <= 0:
+            return None
+
+        def run():
+            while True:
+                time.sleep(interval)
+                self._safe_refresh()
+
+        thread = threading.Thread(target=run, name='model-watcher', daemon=True)
+        thread.start()
+        return thread
+
+    def describe(self):
+        return {
+            'current': self.current.describe() if self.current else None,
+            'available': self.versions(),
+            'shadow': self.shadow.stats()
+        }
+
+
+def publish(source_path, version=None, promote=False, root=None):
+    """Copy a trained model into the registry as a new version"""
+    registry = ModelRegistry(root=root)
+    version = version or datetime.utcnow().strftime('%Y%m%d-%H%M%S')
+    target = registry.model_file(version)
+    if os.path.exists(target):
+        raise ValueError(f'Version already exists: {version}')
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    shutil.copy2(source_path, target)
+    if os.path.exists(tflite_path_for(source_path)):
+        shutil.copy2(tflite_path_for(source_path), tflite_path_for(target))
+    if promote:
+        registry.write_pointer(CURRENT_POINTER, version)
+    return version
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Manage versioned models')
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('list')
+    publish_cmd = sub.add_parser('publish')
+    publish_cmd.add_argument('source')
+    publish_cmd.add_argument('--version')
+    publish_cmd.add_argument('--promote', action='store_true')
+    promote_cmd = sub.add_parser('promote')
+    promote_cmd.add_argument('version')
+    shadow_cmd = sub.add_parser('shadow')
+    shadow_cmd.add_argument('version', help="version name or 'none'")
+    args = parser.parse_args()
+
+    registry = ModelRegistry()
+    if args.command == 'list':
+        current = registry.read_pointer(CURRENT_POINTER)
+        shadow = registry.read_pointer(SHADOW_POINTER)
+        for version in registry.versions():
+            marker = ' (current)' if version == current else ' (shadow)' if version == shadow else ''
+            print(f"{version}{marker}")
+    elif args.command == 'publish':
+        version = publish(args.source, args.version, args.promote)
+        print(f"✅ Published {version}" + (" and promoted" if args.promote else ""))
+    elif args.command == 'promote':
+        registry.write_pointer(CURRENT_POINTER, args.version)
+        print(f"✅ Promoted {args.version} - workers will reload within "
+              f"{Config.MODEL_WATCH_INTERVAL}s")
+    elif args.command == 'shadow':
+        version = None if args.version.lower() == 'none' else args.version
+        registry.write_pointer(SHADOW_POINTER, version)
+        print(f"✅ Shadow set to {version}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+"""
+Perceptual-hash near-duplicate detection
+
+Re-submissions are often the same X-ray re-exported at another size or
+compression, so their bytes (and sha256) differ. A 64-bit DCT perceptual
+hash of the image changes by only a few bits under resizing and
+recompression, so those copies land within a small Hamming distance.
+
+The hash is computed from the array /predict already has (the output of
+preprocess_image): average to grayscale, area-downscale to 32x32, take the
+2D DCT, keep the 8x8 lowest frequencies and threshold them at their median.
+
+Each prediction is appended to an index, one per model version (results
+from another model are never reused):
+
+index/<model_version>.bin
+    fixed-size records: phash (uint64), sha256 digest (32 bytes),
+    label (uint8), score (float32)
+
+Lookups are a vectorized XOR + popcount over every stored hash, which
+costs a few milliseconds per million records.
+"""
+
+import os
+import threading
+import time
+import numpy as np
+from config import Config
+
+try:
+    import fcntl
+except ImportError:  # Windows - appends are not locked across processes
+    fcntl = None
+
+HASH_SIZE = 8
+DCT_SIZE = 32
+RECORD_DTYPE = np.dtype([
+    ('phash', '<u8'),
+    ('digest', 'u1', (32,)),
+    ('label', 'u1'),
+    ('score', '<f4')
+])
+# Set bits per byte value
+POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def _dct_matrix(n):
+    k = np.arange(n)[:, np.newaxis]
+    i = np.arange(n)[np.newaxis, :]
+    return np.cos(np.pi * (2 * i + 1) * k / (2 * n))
+
+
+_DCT = _dct_matrix(DCT_SIZE)
+
+
+def _downscale(gray, size):
+    """Area-average a 2D array to size x size"""
+    height, width = gray.shape
+    if height % size == 0 and width % size == 0:
+        return gray.reshape(size, height // size, size, width // size).mean(axis=(1, 3))
+    rows = np.linspace(0, height, size + 1).astype(int)
+    cols = np.linspace(0, width, size + 1).astype(int)
+    return np.add.reduceat(np.add.reduceat(gray, rows[:-1], axis=0), cols[:-1], axis=1) / \
+        np.outer(np.diff(rows), np.diff(cols))
+
+
+def perceptual_hash(img_array):
+    """
+    64-bit DCT hash of a preprocessed image
+    img_array: output of preprocess_image, (1, height, width, channels)
+    """
+    gray = np.asarray(img_array, dtype=np.float64)[0].mean(axis=-1)
+    coefficients = _DCT @ _downscale(gray, DCT_SIZE) @ _DCT.T
+    low = coefficients[:HASH_SIZE, :HASH_SIZE].ravel()
+    bits = low > np.median(low)
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def hamming_distances(hashes, query):
+    """Bit distance between each uint64 in `hashes` and `query`"""
+    diff = np.bitwise_xor(hashes, np.uint64(query))
+    return POPCOUNT[diff.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+class NearDuplicateIndex:
+    """Append-only perceptual-hash index for one model version"""
+
+    def __init__(self, model_version, root=None):
+        directory = root or Config.PHASH_INDEX_DIR
+        self.path = os.path.join(directory, f'{model_version}.bin')
+        self._lock = threading.Lock()
+        self._count = 0
+        self._records = None
+        self._stats = {'lookups': 0, 'hits': 0, 'lookup_seconds': 0.0, 'max_lookup_seconds': 0.0}
+
+    def add(self, phash, digest, label, score):
+        record = np.zeros(1, dtype=RECORD_DTYPE)
+        record['phash'] = phash
+        record['digest'] = np.frombuffer(bytes.fromhex(digest), dtype=np.uint8)
+        record['label'] = Config.CLASS_LABELS.index(label)
+        record['score'] = score
+
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path, 'ab') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.write(record.tobytes())
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _refresh(self):
+        """Map records appended since the last call (by any process)"""
+        try:
+            count = os.path.getsize(self.path) // RECORD_DTYPE.itemsize
+        except FileNotFoundError:
+            return
+        if count != self._count:
+            self._records = np.memmap(self.path, dtype=RECORD_DTYPE, mode='r', shape=(count,))
+            self._count = count
+
+    def lookup(self, phash, max_distance=None):
+        """
+        Closest stored prediction within max_distance bits, or None
+        Returns {image_digest, distance, prediction, score}
+        """
+        if max_distance is None:
+            max_distance = Config.PHASH_MAX_DISTANCE
+        start = time.perf_counter()
+        match = None
+        with self._lock:
+            self._refresh()
+            if self._count:
+                distances = hamming_distances(self._records['phash'], phash)
+                best = int(np.argmin(distances))
+                if distances[best] <= max_distance:
+                    record = self._records[best]
+                    match = {
+                        'image_digest': record['digest'].tobytes().hex(),
+                        'distance': int(distances[best]),
+                        'prediction': Config.CLASS_LABELS[int(record['label'])],
+                        'score': float(record['score'])
+                    }
+
+            elapsed = time.perf_counter() - start
+            self._stats['lookups'] += 1
+            self._stats['hits'] += int(match is not None)
+            self._stats['lookup_seconds'] += elapsed
+            self._stats['max_lookup_seconds'] = max(self._stats['max_lookup_seconds'], elapsed)
+        return match
+
+    def stats(self):
+        """Index size, hit rate and lookup latency for this worker"""
+        with self._lock:
+            self._refresh()
+            s = dict(self._stats)
+            size = self._count
+        lookups = s['lookups']
+        return {
+            'size': size,
+            'max_distance': Config.PHASH_MAX_DISTANCE,
+            'lookups': lookups,
+            'hits': s['hits'],
+            'hit_rate': round(s['hits'] / lookups, 4) if lookups else None,
+            'mean_lookup_ms': round(s['lookup_seconds'] * 1000.0 / lookups, 3) if lookups else None,
+            'max_lookup_ms': round(s['max_lookup_seconds'] * 1000.0, 3)
+        }
@@ -0,0 +1,85 @@
+"""
+HTTP caching for read endpoints (/history, /stats)
+
+A data version token is stored in a small file shared by every worker
+process on the machine (and by offline tools like bulk_score.py). Every
+prediction write replaces the token. Read responses are then:
+
+- 304 Not Modified when the client's If-None-Match matches the ETag derived
+  from (data version, endpoint, query string) - no database query at all
+- served from this worker's in-memory copy when it was built for the same
+  data version
+- recomputed from MongoDB only after a write has bumped the version
+"""
+
+import hashlib
+import os
+import tempfile
+import threading
+import uuid
+from functools import wraps
+from flask import request, make_response
+from config import Config
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def current_data_version():
+    """Token identifying the current state of the predictions data"""
+    try:
+        with open(Config.DATA_VERSION_FILE) as f:
+            return f.read().strip() or 'initial'
+    except FileNotFoundError:
+        return 'initial'
+
+
+def bump_data_version():
+    """Invalidate cached read responses in every worker"""
+    try:
+        directory = os.path.dirname(Config.DATA_VERSION_FILE) or '.'
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, 'w') as f:
+            f.write(uuid.uuid4().hex)
+        os.replace(tmp_path, Config.DATA_VERSION_FILE)
+    except OSError as e:
+        print(f"Error bumping data version: {str(e)}")
+
+
+def _etag(version, key):
+    return hashlib.sha1(f'{version}|{key}'.encode()).hexdigest()[:20]
+
+
+def cached_response(view):
+    """
+    Decorator for GET views whose output depends only on the predictions data
+    Only successful (200) responses are cached.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = f'{request.path}?{request.query_string.decode()}'
+        version = current_data_version()
+        etag = _etag(version, key)
+
+        if etag in request.if_none_match:
+            response = make_response('', 304)
+        else:
+            with _cache_lock:
+                entry = _cache.get(key)
+            if entry is not None and entry[0] == version:
+                response = make_response(entry[1], 200)
+                response.mimetype = 'application/json'
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+                with _cache_lock:
+                    if len(_cache) >= Config.RESPONSE_CACHE_ENTRIES:
+                        _cache.clear()
+                    _cache[key] = (version, response.get_data())
+
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    return wrapper
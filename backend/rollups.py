@@ -0,0 +1,186 @@
+"""
+Time-bucketed prediction rollups
+
+Every prediction write also increments one pre-aggregated document per
+(granularity, bucket, label) in the `prediction_rollups` collection:
+
+{
+    '_id': 'hour:2025-01-08T09:00:00:PNEUMONIA',
+    'granularity': 'hour',
+    'bucket': datetime(2025, 1, 8, 9),
+    'label': 'PNEUMONIA',
+    'count': 42,
+    'confidence_sum': 37.1,
+    'hist': {'0': 1, '7': 12, ...}    # confidence histogram, see HIST_*
+}
+
+Ranged /stats queries read only these buckets (indexed on granularity +
+bucket), so their cost depends on the number of buckets in the range, not
+on how many raw predictions exist.
+
+Usage:
+    python rollups.py rebuild    # backfill from the raw predictions collection
+"""
+
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from config import Config
+
+GRANULARITIES = ('hour', 'day')
+# Binary confidence is always >= 0.5: 10 bins of 0.05 over [0.5, 1.0]
+HIST_MIN = 0.5
+HIST_BIN_WIDTH = 0.05
+HIST_BINS = 10
+
+
+def bucket_start(timestamp, granularity):
+    """Truncate a datetime to the start of its bucket"""
+    if granularity == 'hour':
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    if granularity == 'day':
+        return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+    raise ValueError(f'Unknown granularity: {granularity}')
+
+
+def hist_bin(confidence):
+    index = int((confidence - HIST_MIN) / HIST_BIN_WIDTH)
+    return min(max(index, 0), HIST_BINS - 1)
+
+
+def rollup_increments(records):
+    """
+    Aggregate (timestamp, label, confidence) records in memory
+    Returns {(granularity, bucket, label): {field: increment}}
+    """
+    increments = defaultdict(lambda: defaultdict(int))
+    for timestamp, label, confidence in records:
+        for granularity in GRANULARITIES:
+            key = (granularity, bucket_start(timestamp, granularity), label)
+            inc = increments[key]
+            inc['count'] += 1
+            inc['confidence_sum'] += float(confidence)
+            inc[f'hist.{hist_bin(confidence)}'] += 1
+    return increments
+
+
+def update_rollups(db, records):
+    """
+    Apply rollup increments for newly written predictions
+    One upsert per touched bucket, sent as a single bulk write
+    """
+    from pymongo import UpdateOne
+
+    operations = []
+    for (granularity, bucket, label), inc in rollup_increments(records).items():
+        operations.append(UpdateOne(
+            {'_id': f'{granularity}:{bucket.isoformat()}:{label}'},
+            {
+                '$setOnInsert': {'granularity': granularity, 'bucket': bucket, 'label': label},
+                '$inc': dict(inc)
+            },
+            upsert=True
+        ))
+    if operations:
+        db.prediction_rollups.bulk_write(operations, ordered=False)
+
+
+def ensure_indexes(db):
+    try:
+        db.prediction_rollups.create_index([('granularity', 1), ('bucket', 1)])
+    except Exception as e:
+        print(f"Error creating rollup index: {str(e)}")
+
+
+def parse_time(value):
+    """
+    Accept YYYY-MM-DD or a full ISO timestamp
+    Offsets are converted to UTC; naive values are taken as UTC already.
+    """
+    dt = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+
+def query_rollups(db, start, end, granularity):
+    """
+    Series of buckets in [start, end) at the given granularity
+    Empty buckets are omitted.
+    """
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"granularity must be one of: {', '.join(GRANULARITIES)}")
+    if end <= start:
+        raise ValueError("'to' must be after 'from'")
+    step = timedelta(hours=1) if granularity == 'hour' else timedelta(days=1)
+    if (end - start) / step > Config.STATS_MAX_BUCKETS:
+        raise ValueError(
+            f'Range too large: at most {Config.STATS_MAX_BUCKETS} {granularity} buckets'
+        )
+
+    cursor = db.prediction_rollups.find({
+        'granularity': granularity,
+        'bucket': {'$gte': bucket_start(start, granularity), '$lt': end}
+    })
+
+    series = {}
+    for doc in cursor:
+        entry = series.setdefault(doc['bucket'], {
+            'bucket': doc['bucket'].isoformat(),
+            'total': 0,
+            'confidence_sum': 0.0,
+            'labels': {},
+            'histogram': [0] * HIST_BINS
+        })
+        entry['total'] += doc.get('count', 0)
+        entry['confidence_sum'] += doc.get('confidence_sum', 0.0)
+        entry['labels'][doc['label']] = doc.get('count', 0)
+        for index, count in doc.get('hist', {}).items():
+            entry['histogram'][int(index)] += count
+
+    result = []
+    for bucket in sorted(series):
+        entry = series[bucket]
+        total = entry['total']
+        pneumonia = entry['labels'].get(Config.CLASS_LABELS[1], 0)
+        result.append({
+            'bucket': entry['bucket'],
+            'total': total,
+            'pneumonia_detected': pneumonia,
+            'normal_detected': entry['labels'].get(Config.CLASS_LABELS[0], 0),
+            'pneumonia_rate': round(pneumonia / total, 4) if total else None,
+            'mean_confidence': round(entry['confidence_sum'] / total, 4) if total else None,
+            'confidence_histogram': entry['histogram']
+        })
+    return result
+
+
+def rebuild(db, batch_size=5000):
+    """Recompute all rollups from the raw predictions collection"""
+    db.prediction_rollups.delete_many({})
+    ensure_indexes(db)
+    batch = []
+    total = 0
+    for doc in db.predictions.find({}, {'timestamp': 1, 'result': 1, 'confidence': 1}):
+        try:
+            batch.append((parse_time(doc['timestamp']), doc['result'], doc['confidence']))
+        except (KeyError, TypeError, ValueError):
+            continue
+        if len(batch) >= batch_size:
+            update_rollups(db, batch)
+            total += len(batch)
+            batch = []
+    update_rollups(db, batch)
+    return total + len(batch)
+
+
+if __name__ == '__main__':
+    import sys
+    from pymongo import MongoClient
+    from response_cache import bump_data_version
+
+    if sys.argv[1:] != ['rebuild']:
+        print("Usage: python rollups.py rebuild")
+        sys.exit(1)
+    count = rebuild(MongoClient(Config.MONGO_URI).pneumonia_db)
+    bump_data_version()
+    print(f"✅ Rebuilt rollups from {count} predictions")
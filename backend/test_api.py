@@ -5,9 +5,22 @@ Run this after starting the Flask server to verify everything works
 
 import requests
 import json
+import struct
+import zlib
 
 BASE_URL = "http://localhost:8000"
 
+def make_png(width, height):
+    """A black 8-bit grayscale PNG, built without any imaging library"""
+    def chunk(kind, data):
+        body = kind + data
+        return struct.pack('>I', len(data)) + body + struct.pack('>I', zlib.crc32(body))
+    rows = b''.join(b'\x00' + b'\x00' * width for _ in range(height))
+    return (b'\x89PNG\r\n\x1a\n'
+            + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 0, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(rows))
+            + chunk(b'IEND', b''))
+
 def test_health_check():
     """Test the health check endpoint"""
     print("🧪 Testing Health Check Endpoint...")
@@ -46,6 +59,51 @@ def test_stats_endpoint():
         print(f"❌ Error: {str(e)}")
         return False
 
+def test_stats_range():
+    """Test a ranged stats query (time series from the rollups)"""
+    print("\n🧪 Testing Ranged Statistics...")
+    try:
+        params = {'from': '2025-01-01', 'to': '2025-01-02T00:00:00+02:00', 'granularity': 'hour'}
+        response = requests.get(f"{BASE_URL}/stats", params=params)
+        if response.status_code != 200:
+            print(f"❌ Ranged stats failed with status code: {response.status_code}")
+            return False
+        data = response.json()
+        # +02:00 is converted to UTC before bucketing
+        if data.get('to') != '2025-01-01T22:00:00' or not isinstance(data.get('series'), list):
+            print(f"❌ Unexpected ranged stats response: {data}")
+            return False
+        bad = requests.get(f"{BASE_URL}/stats", params={**params, 'granularity': 'week'})
+        if bad.status_code != 400:
+            print(f"❌ Invalid granularity returned status code: {bad.status_code}")
+            return False
+        print("✅ Ranged stats working!")
+        print(f"   Buckets: {len(data['series'])}")
+        return True
+    except Exception as e:
+        print(f"❌ Error: {str(e)}")
+        return False
+
+def test_stats_not_modified():
+    """Test that repeating a stats request with its ETag returns 304"""
+    print("\n🧪 Testing Statistics Cache (If-None-Match)...")
+    try:
+        response = requests.get(f"{BASE_URL}/stats")
+        etag = response.headers.get('ETag')
+        if response.status_code != 200 or not etag:
+            print(f"❌ Expected 200 with an ETag, got {response.status_code} ({etag})")
+            return False
+        cached = requests.get(f"{BASE_URL}/stats", headers={'If-None-Match': etag})
+        if cached.status_code == 304:
+            print("✅ Unchanged stats return 304 Not Modified!")
+            return True
+        else:
+            print(f"❌ Expected 304, got status code: {cached.status_code}")
+            return False
+    except Exception as e:
+        print(f"❌ Error: {str(e)}")
+        return False
+
 def test_history_endpoint():
     """Test the history endpoint"""
     print("\n🧪 Testing History Endpoint...")
@@ -78,6 +136,53 @@ def test_predict_endpoint_no_file():
         print(f"❌ Error: {str(e)}")
         return False
 
+def test_predict_rejects_non_image():
+    """Test that a non-image with an image extension is rejected from its header"""
+    print("\n🧪 Testing Predict Endpoint (not an image)...")
+    try:
+        files = {'file': ('xray.png', b'definitely not a png', 'image/png')}
+        response = requests.post(f"{BASE_URL}/predict", files=files)
+        if response.status_code == 415 and response.json().get('reason') == 'not_an_image':
+            print("✅ Predict endpoint correctly rejects non-images!")
+            return True
+        else:
+            print(f"⚠️  Unexpected response: {response.status_code} {response.text}")
+            return False
+    except Exception as e:
+        print(f"❌ Error: {str(e)}")
+        return False
+
+def test_predict_rejects_tiny_image():
+    """Test that an image below the minimum dimension is rejected"""
+    print("\n🧪 Testing Predict Endpoint (tiny image)...")
+    try:
+        files = {'file': ('tiny.png', make_png(8, 8), 'image/png')}
+        response = requests.post(f"{BASE_URL}/predict", files=files)
+        if response.status_code == 400 and response.json().get('reason') == 'dimensions_too_small':
+            print("✅ Predict endpoint correctly rejects tiny images!")
+            return True
+        else:
+            print(f"⚠️  Unexpected response: {response.status_code} {response.text}")
+            return False
+    except Exception as e:
+        print(f"❌ Error: {str(e)}")
+        return False
+
+def test_explain_unknown_digest():
+    """Test the explain endpoint with a digest that was never uploaded"""
+    print("\n🧪 Testing Explain Endpoint (unknown digest)...")
+    try:
+        response = requests.get(f"{BASE_URL}/explain/{'0' * 64}")
+        if response.status_code == 404:
+            print("✅ Explain endpoint correctly rejects unknown images!")
+            return True
+        else:
+            print(f"⚠️  Unexpected status code: {response.status_code}")
+            return False
+    except Exception as e:
+        print(f"❌ Error: {str(e)}")
+        return False
+
 def main():
     """Run all tests"""
     print("=" * 60)
@@ -89,8 +194,13 @@ def main():
     results = []
     results.append(test_health_check())
     results.append(test_stats_endpoint())
+    results.append(test_stats_range())
+    results.append(test_stats_not_modified())
     results.append(test_history_endpoint())
     results.append(test_predict_endpoint_no_file())
+    results.append(test_predict_rejects_non_image())
+    results.append(test_predict_rejects_tiny_image())
+    results.append(test_explain_unknown_digest())
     
     print("\n" + "=" * 60)
     print("📊 TEST SUMMARY")
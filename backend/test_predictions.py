@@ -3,16 +3,20 @@ Quick test to check model predictions on uploaded images
 """
 import os
 from tensorflow import keras
-import numpy as np
-from PIL import Image
+from utils import preprocess_image
 
 # Load model
 model = keras.models.load_model('model/pneumonia_model.h5')
 print("✅ Model loaded\n")
 
-# Test images
+# Test images (uploads are stored in sharded subdirectories)
 uploads_dir = 'uploads'
-images = [f for f in os.listdir(uploads_dir) if f.endswith(('.jpg', '.jpeg', '.png'))]
+images = sorted(
+    os.path.relpath(os.path.join(root, f), uploads_dir)
+    for root, _, files in os.walk(uploads_dir)
+    for f in files
+    if f.endswith(('.jpg', '.jpeg', '.png'))
+)
 
 print("🔍 Testing predictions on uploaded images:\n")
 print("="*60)
@@ -20,11 +24,8 @@ print("="*60)
 for img_file in images:
     img_path = os.path.join(uploads_dir, img_file)
     
-    # Preprocess image
-    img = Image.open(img_path).convert('RGB')
-    img = img.resize((128, 128))
-    img_array = np.array(img) / 255.0
-    img_array = np.expand_dims(img_array, axis=0)
+    # Preprocess image (grayscale or RGB, whatever the model expects)
+    img_array = preprocess_image(img_path, model.input_shape[1:])
     
     # Predict
     prediction = model.predict(img_array, verbose=0)[0][0]
@@ -0,0 +1,33 @@
+"""
+TensorFlow CPU thread-pool settings
+
+By default every process sizes both TensorFlow pools to the number of
+cores. With several gunicorn workers on one box that oversubscribes the
+CPU (workers x cores busy threads) and hurts latency and throughput alike.
+TF_INTRA_OP_THREADS / TF_INTER_OP_THREADS (0 = TensorFlow's default) cap
+them per process; `python autotune.py` finds good values for a machine.
+
+The pools can only be sized before TensorFlow runs its first op, so call
+configure_threads() before loading any model.
+"""
+
+from config import Config
+
+
+def configure_threads(intra=None, inter=None):
+    """Apply thread-pool sizes (defaults from Config); returns (intra, inter)"""
+    import tensorflow as tf
+
+    intra = Config.TF_INTRA_OP_THREADS if intra is None else intra
+    inter = Config.TF_INTER_OP_THREADS if inter is None else inter
+    try:
+        if intra:
+            tf.config.threading.set_intra_op_parallelism_threads(intra)
+        if inter:
+            tf.config.threading.set_inter_op_parallelism_threads(inter)
+    except RuntimeError as e:
+        # The runtime is already initialized; the existing pools stay in place
+        print(f"⚠️  Could not set TensorFlow thread pools: {str(e)}")
+    if intra or inter:
+        print(f"✅ TensorFlow threads: intra-op={intra or 'default'}, inter-op={inter or 'default'}")
+    return intra, inter
@@ -0,0 +1,301 @@
+"""
+KNOWLEDGE DISTILLATION - VGG16 teacher → compact CNN student
+
+The VGG16 transfer model (train_transfer_learning.py) is the most accurate
+but too slow for high-volume CPU serving. Here it acts as a teacher: its
+predictions on the training set are computed ONCE and cached, and a small
+CNN student is trained to match those soft targets as well as the true
+labels.
+
+Loss = ALPHA * BCE(label, student) + (1 - ALPHA) * T² * BCE(soft_teacher, soft_student)
+where soft_* are the sigmoid outputs with logits divided by TEMPERATURE.
+
+Outputs:
+- model/student_model.h5          (serving-ready, loads without custom objects)
+- model/teacher_soft_targets.npz  (cache, reused while the teacher is unchanged)
+- model/distillation_report.json  (latency/size/accuracy vs both parents)
+"""
+
+import json
+import os
+import time
+import numpy as np
+import pandas as pd
+import tensorflow as tf
+from tensorflow import keras
+from tensorflow.keras import layers
+from tensorflow.keras.preprocessing.image import ImageDataGenerator
+from tensorflow.keras.callbacks import ReduceLROnPlateau
+from tf_threads import configure_threads
+from utils import file_digest
+
+# Configuration
+IMG_SIZE = (128, 128)
+BATCH_SIZE = 64
+EPOCHS = 15
+DATASET_PATH = '../dataset/chest_xray'
+TEACHER_MODEL_PATH = os.getenv('TEACHER_MODEL_PATH', 'model/teacher_vgg16.h5')
+BASELINE_MODEL_PATH = os.getenv('BASELINE_MODEL_PATH', 'model/cnn_model.h5')
+STUDENT_SAVE_PATH = 'model/student_model.h5'
+SOFT_TARGETS_PATH = 'model/teacher_soft_targets.npz'
+REPORT_PATH = 'model/distillation_report.json'
+TEMPERATURE = 4.0
+ALPHA = 0.3  # weight of the hard-label loss
+EPSILON = 1e-6
+
+
+def cache_teacher_predictions(teacher):
+    """
+    Run the teacher over the (un-augmented) training set once
+    Cached per teacher file, so repeated student runs skip this entirely.
+    Returns (filenames, labels, teacher_probs)
+    """
+    teacher_digest = file_digest(TEACHER_MODEL_PATH)
+    if os.path.exists(SOFT_TARGETS_PATH):
+        cache = np.load(SOFT_TARGETS_PATH, allow_pickle=False)
+        if str(cache['teacher_digest']) == teacher_digest:
+            print(f"✅ Using cached teacher soft targets ({len(cache['filenames'])} images)")
+            return list(cache['filenames']), cache['labels'], cache['probs']
+
+    print("\n🧑‍🏫 Computing teacher soft targets (one-time)...")
+    generator = ImageDataGenerator(rescale=1./255).flow_from_directory(
+        os.path.join(DATASET_PATH, 'train'),
+        target_size=IMG_SIZE,
+        batch_size=BATCH_SIZE,
+        class_mode='binary',
+        shuffle=False
+    )
+    probs = teacher.predict(generator, verbose=1).flatten().astype(np.float32)
+    filenames = np.array(generator.filenames)
+    labels = generator.classes.astype(np.float32)
+
+    np.savez(
+        SOFT_TARGETS_PATH,
+        filenames=filenames,
+        labels=labels,
+        probs=probs,
+        teacher_digest=np.array(teacher_digest)
+    )
+    print(f"💾 Saved teacher soft targets to {SOFT_TARGETS_PATH}")
+    return list(filenames), labels, probs
+
+
+def soften(probs, temperature):
+    """Divide the logits of sigmoid probabilities by the temperature"""
+    probs = np.clip(probs, EPSILON, 1 - EPSILON)
+    logits = np.log(probs / (1 - probs))
+    return 1.0 / (1.0 + np.exp(-logits / temperature))
+
+
+def create_distillation_generators(filenames, labels, probs):
+    """
+    Training generator yields y = [hard label, softened teacher prob]
+    The teacher target is treated as invariant to the light augmentation.
+    """
+    frame = pd.DataFrame({
+        'filename': filenames,
+        'label': labels,
+        'soft': soften(probs, TEMPERATURE)
+    })
+    train_datagen = ImageDataGenerator(
+        rescale=1./255,
+        rotation_range=15,
+        width_shift_range=0.1,
+        height_shift_range=0.1,
+        shear_range=0.1,
+        zoom_range=0.1,
+        horizontal_flip=True,
+        fill_mode='nearest'
+    )
+    train_generator = train_datagen.flow_from_dataframe(
+        frame,
+        directory=os.path.join(DATASET_PATH, 'train'),
+        x_col='filename',
+        y_col=['label', 'soft'],
+        target_size=IMG_SIZE,
+        batch_size=BATCH_SIZE,
+        class_mode='raw',
+        shuffle=True
+    )
+
+    test_generator = ImageDataGenerator(rescale=1./255).flow_from_directory(
+        os.path.join(DATASET_PATH, 'test'),
+        target_size=IMG_SIZE,
+        batch_size=BATCH_SIZE,
+        class_mode='binary',
+        shuffle=False
+    )
+    return train_generator, test_generator
+
+
+def build_student_model():
+    """
+    Compact student CNN
+    Narrower convolutions and global average pooling instead of a large
+    Flatten → Dense(256) block; keeps the 128-unit penultimate Dense layer.
+    """
+    model = keras.Sequential([
+        layers.Conv2D(16, (3, 3), activation='relu', input_shape=IMG_SIZE + (3,)),
+        layers.BatchNormalization(),
+        layers.MaxPooling2D((2, 2)),
+
+        layers.Conv2D(32, (3, 3), activation='relu'),
+        layers.BatchNormalization(),
+        layers.MaxPooling2D((2, 2)),
+
+        layers.Conv2D(64, (3, 3), activation='relu'),
+        layers.BatchNormalization(),
+        layers.MaxPooling2D((2, 2)),
+
+        layers.Conv2D(64, (3, 3), activation='relu'),
+        layers.BatchNormalization(),
+        layers.GlobalAveragePooling2D(),
+
+        layers.Dense(128, activation='relu'),
+        layers.Dropout(0.3),
+        layers.Dense(1, activation='sigmoid')
+    ])
+    return model
+
+
+def distillation_loss(y_true, y_pred):
+    """Hard-label BCE blended with temperature-scaled teacher BCE"""
+    hard = y_true[:, 0:1]
+    soft = y_true[:, 1:2]
+    y_pred = tf.clip_by_value(y_pred, EPSILON, 1 - EPSILON)
+
+    hard_loss = keras.losses.binary_crossentropy(hard, y_pred)
+    student_logits = tf.math.log(y_pred / (1 - y_pred))
+    soft_pred = tf.sigmoid(student_logits / TEMPERATURE)
+    soft_loss = keras.losses.binary_crossentropy(soft, soft_pred)
+    return ALPHA * hard_loss + (1 - ALPHA) * (TEMPERATURE ** 2) * soft_loss
+
+
+def hard_accuracy(y_true, y_pred):
+    """Accuracy against the true label column"""
+    return keras.metrics.binary_accuracy(y_true[:, 0:1], y_pred)
+
+
+def measure_latency(model, batch_size, runs=20):
+    """Median forward-pass latency (ms)"""
+    batch = np.random.rand(batch_size, *model.input_shape[1:]).astype(np.float32)
+    model.predict(batch, batch_size=batch_size, verbose=0)
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        model.predict(batch, batch_size=batch_size, verbose=0)
+        timings.append((time.perf_counter() - start) * 1000.0)
+    return float(np.median(timings))
+
+
+def evaluate_model(name, model, path, test_gen):
+    """Size, latency and test accuracy for the report"""
+    test_gen.reset()
+    y_pred = model.predict(test_gen, verbose=0).flatten()
+    accuracy = float(np.mean((y_pred > 0.5).astype(int) == test_gen.classes))
+    return {
+        'model': name,
+        'path': path,
+        'params': int(model.count_params()),
+        'size_mb': round(os.path.getsize(path) / (1024 * 1024), 2) if os.path.exists(path) else None,
+        'latency_ms_batch1': round(measure_latency(model, 1), 2),
+        'latency_ms_batch32': round(measure_latency(model, 32), 2),
+        'test_accuracy': round(accuracy, 4)
+    }
+
+
+def train_model():
+    """Main distillation function"""
+    print("=" * 60)
+    print("🚀 KNOWLEDGE DISTILLATION - VGG16 → Compact CNN")
+    print("=" * 60)
+    configure_threads()
+
+    if not os.path.exists(DATASET_PATH):
+        print(f"❌ Dataset not found at {DATASET_PATH}")
+        return
+    if not os.path.exists(TEACHER_MODEL_PATH):
+        print(f"❌ Teacher model not found at {TEACHER_MODEL_PATH}")
+        print(f"Train it with: MODEL_SAVE_PATH={TEACHER_MODEL_PATH} python train_transfer_learning.py")
+        print("(or set TEACHER_MODEL_PATH)")
+        return
+    # The report is a three-way comparison; don't train for an hour and then drop a row
+    if not os.path.exists(BASELINE_MODEL_PATH):
+        print(f"❌ Baseline CNN not found at {BASELINE_MODEL_PATH}")
+        print(f"Train it with: MODEL_SAVE_PATH={BASELINE_MODEL_PATH} python train_model.py")
+        print("(or set BASELINE_MODEL_PATH)")
+        return
+
+    os.makedirs('model', exist_ok=True)
+
+    teacher = keras.models.load_model(TEACHER_MODEL_PATH)
+    filenames, labels, probs = cache_teacher_predictions(teacher)
+    train_gen, test_gen = create_distillation_generators(filenames, labels, probs)
+
+    print(f"✅ Training samples: {train_gen.samples}")
+    print(f"✅ Test samples: {test_gen.samples}")
+    print(f"Temperature: {TEMPERATURE}, hard-label weight: {ALPHA}")
+
+    print("\n🏗️  Building student model...")
+    student = build_student_model()
+    student.compile(
+        optimizer=keras.optimizers.Adam(learning_rate=0.001),
+        loss=distillation_loss,
+        metrics=[hard_accuracy]
+    )
+    student.summary()
+
+    callbacks = [
+        ReduceLROnPlateau(
+            monitor='loss',
+            factor=0.5,
+            patience=2,
+            min_lr=1e-6,
+            verbose=1
+        )
+    ]
+
+    print("\n🎯 Training student on teacher soft targets...")
+    student.fit(
+        train_gen,
+        epochs=EPOCHS,
+        callbacks=callbacks,
+        verbose=1
+    )
+
+    # Recompile with a standard loss so the saved file loads anywhere
+    student.compile(
+        optimizer=keras.optimizers.Adam(learning_rate=0.001),
+        loss='binary_crossentropy',
+        metrics=['accuracy']
+    )
+    student.save(STUDENT_SAVE_PATH)
+    print(f"\n✅ Student saved to {STUDENT_SAVE_PATH}")
+    print(f"   Publish for hot reload: python model_registry.py publish {STUDENT_SAVE_PATH} --promote")
+
+    print("\n📈 Comparing student against both parents...")
+    baseline = keras.models.load_model(BASELINE_MODEL_PATH)
+    report = [
+        evaluate_model('teacher_vgg16', teacher, TEACHER_MODEL_PATH, test_gen),
+        evaluate_model('baseline_cnn', baseline, BASELINE_MODEL_PATH, test_gen),
+        evaluate_model('student', student, STUDENT_SAVE_PATH, test_gen)
+    ]
+
+    with open(REPORT_PATH, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print("\n" + "=" * 60)
+    print("📊 DISTILLATION REPORT:")
+    print("=" * 60)
+    print(f"{'Model':16s} {'Params':>12s} {'Size MB':>9s} {'ms@1':>8s} {'ms@32':>8s} {'Acc':>8s}")
+    for row in report:
+        size = f"{row['size_mb']:.2f}" if row['size_mb'] is not None else '-'
+        print(f"{row['model']:16s} {row['params']:>12,} {size:>9s} "
+              f"{row['latency_ms_batch1']:>8.2f} {row['latency_ms_batch32']:>8.2f} "
+              f"{row['test_accuracy'] * 100:>7.2f}%")
+    print(f"\n💾 Report saved to {REPORT_PATH}")
+    print("=" * 60)
+
+
+if __name__ == '__main__':
+    train_model()
@@ -27,30 +27,28 @@ from tensorflow.keras.callbacks import EarlyStopping, ReduceLROnPlateau, ModelCh
 from sklearn.metrics import classification_report, confusion_matrix
 from sklearn.utils.class_weight import compute_class_weight
 import seaborn as sns
+from tf_threads import configure_threads
+from training_pipeline import build_augmentation, with_augmentation, ThroughputLogger
 
 # Configuration
 IMG_SIZE = (128, 128)  # Smaller images = less computation
 BATCH_SIZE = 64  # Bigger batches = fewer iterations
 EPOCHS = 10  # Increased to 10 for better learning
 DATASET_PATH = '../dataset/chest_xray'
-MODEL_SAVE_PATH = 'model/pneumonia_model.h5'
+MODEL_SAVE_PATH = os.getenv('MODEL_SAVE_PATH', 'model/pneumonia_model.h5')
+# X-rays are grayscale: COLOR_MODE=grayscale trains a 1-channel model
+# (1/3 the decode memory, input bandwidth and first-layer compute)
+COLOR_MODE = os.getenv('COLOR_MODE', 'rgb')
+CHANNELS = 1 if COLOR_MODE == 'grayscale' else 3
 
-def create_data_generators():
+def create_data_generators(color_mode=COLOR_MODE):
     """
     Create data generators for training, validation, and testing
-    Includes data augmentation for training set
+    Training augmentation runs in-graph (see build_augmentation), not here
+    color_mode: 'rgb' or 'grayscale'
     """
-    # Training data augmentation
-    train_datagen = ImageDataGenerator(
-        rescale=1./255,
-        rotation_range=20,
-        width_shift_range=0.2,
-        height_shift_range=0.2,
-        shear_range=0.2,
-        zoom_range=0.2,
-        horizontal_flip=True,
-        fill_mode='nearest'
-    )
+    # Training data (only rescaling - augmented batch-wise inside the training step)
+    train_datagen = ImageDataGenerator(rescale=1./255)
     
     # Validation and test data (only rescaling)
     val_test_datagen = ImageDataGenerator(rescale=1./255)
@@ -61,6 +59,7 @@ def create_data_generators():
         target_size=IMG_SIZE,
         batch_size=BATCH_SIZE,
         class_mode='binary',
+        color_mode=color_mode,
         shuffle=True
     )
     
@@ -69,6 +68,7 @@ def create_data_generators():
         target_size=IMG_SIZE,
         batch_size=BATCH_SIZE,
         class_mode='binary',
+        color_mode=color_mode,
         shuffle=False
     )
     
@@ -77,19 +77,21 @@ def create_data_generators():
         target_size=IMG_SIZE,
         batch_size=BATCH_SIZE,
         class_mode='binary',
+        color_mode=color_mode,
         shuffle=False
     )
     
     return train_generator, val_generator, test_generator
 
-def build_cnn_model():
+def build_cnn_model(channels=CHANNELS):
     """
     Build IMPROVED CNN model architecture (Mac-friendly!)
     Architecture: Conv2D → MaxPooling → BatchNorm → Dropout → Dense → Sigmoid
+    channels: 3 for RGB input, 1 for native grayscale
     """
     model = keras.Sequential([
         # First Convolutional Block
-        layers.Conv2D(32, (3, 3), activation='relu', input_shape=(128, 128, 3)),
+        layers.Conv2D(32, (3, 3), activation='relu', input_shape=IMG_SIZE + (channels,)),
         layers.BatchNormalization(),
         layers.MaxPooling2D((2, 2)),
         layers.Dropout(0.25),
@@ -127,6 +129,7 @@ def train_model():
     print("=" * 60)
     print("🚀 Starting Pneumonia Detection Model Training")
     print("=" * 60)
+    configure_threads()
     
     # Check if dataset exists
     if not os.path.exists(DATASET_PATH):
@@ -159,11 +162,21 @@ def train_model():
     print(f"  → PNEUMONIA (class 1): {class_weight_dict[1]:.2f}")
     
     # Build model
-    print("\n🏗️  Building CNN model...")
+    print(f"\n🏗️  Building CNN model ({COLOR_MODE}, {CHANNELS} channel(s))...")
     model = build_cnn_model()
     
+    # Batched in-graph augmentation in front of the model, for training only
+    # (same ranges the ImageDataGenerator used); `model` itself is what gets saved
+    trainer = with_augmentation(model, build_augmentation(
+        rotation_range=20,
+        shift_range=0.2,
+        shear_range=0.2,
+        zoom_range=0.2,
+        horizontal_flip=True
+    ))
+    
     # Compile model
-    model.compile(
+    trainer.compile(
         optimizer=keras.optimizers.Adam(learning_rate=0.0001),
         loss='binary_crossentropy',
         metrics=['accuracy', keras.metrics.Precision(), keras.metrics.Recall()]
@@ -182,12 +195,14 @@ def train_model():
             patience=3,
             min_lr=1e-7,
             verbose=1
-        )
+        ),
+        # images/sec, step time and batch-production time per epoch → model/training_throughput.jsonl
+        ThroughputLogger('train_model', train_gen)
     ]
     
     # Train model with class weights
     print("\n🎯 Training model with balanced class weights...")
-    history = model.fit(
+    history = trainer.fit(
         train_gen,
         epochs=EPOCHS,
         validation_data=val_gen,
@@ -199,10 +214,11 @@ def train_model():
     # Save final model
     model.save(MODEL_SAVE_PATH)
     print(f"\n✅ Model saved to {MODEL_SAVE_PATH}")
+    print(f"   Publish for hot reload: python model_registry.py publish {MODEL_SAVE_PATH} --promote")
     
     # Evaluate on test set
     print("\n📈 Evaluating on test set...")
-    test_loss, test_acc, test_precision, test_recall = model.evaluate(test_gen)
+    test_loss, test_acc, test_precision, test_recall = trainer.evaluate(test_gen)
     
     print("\n" + "=" * 60)
     print("📊 TEST RESULTS:")
@@ -214,7 +230,7 @@ def train_model():
     
     # Generate predictions for confusion matrix
     print("\n🔍 Generating predictions for confusion matrix...")
-    y_pred = model.predict(test_gen)
+    y_pred = trainer.predict(test_gen)
     
     # Find optimal threshold
     print("\n🎯 Finding optimal prediction threshold...")
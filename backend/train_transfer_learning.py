@@ -17,26 +17,19 @@ from tensorflow.keras.callbacks import ReduceLROnPlateau
 from sklearn.metrics import classification_report, confusion_matrix
 from sklearn.utils.class_weight import compute_class_weight
 import seaborn as sns
+from tf_threads import configure_threads
+from training_pipeline import build_augmentation, with_augmentation, ThroughputLogger
 
 # Configuration
 IMG_SIZE = (128, 128)
 BATCH_SIZE = 32  # Smaller batch for transfer learning
 EPOCHS = 10
 DATASET_PATH = '../dataset/chest_xray'
-MODEL_SAVE_PATH = 'model/pneumonia_model.h5'
+MODEL_SAVE_PATH = os.getenv('MODEL_SAVE_PATH', 'model/pneumonia_model.h5')
 
 def create_data_generators():
-    """Create data generators with augmentation"""
-    train_datagen = ImageDataGenerator(
-        rescale=1./255,
-        rotation_range=15,
-        width_shift_range=0.1,
-        height_shift_range=0.1,
-        shear_range=0.1,
-        zoom_range=0.1,
-        horizontal_flip=True,
-        fill_mode='nearest'
-    )
+    """Create data generators (training augmentation runs in-graph, see train_model)"""
+    train_datagen = ImageDataGenerator(rescale=1./255)
     
     val_test_datagen = ImageDataGenerator(rescale=1./255)
     
@@ -104,6 +97,7 @@ def train_model():
     print("=" * 60)
     print("🚀 TRANSFER LEARNING - Pneumonia Detection Training")
     print("=" * 60)
+    configure_threads()
     
     if not os.path.exists(DATASET_PATH):
         print(f"❌ Dataset not found at {DATASET_PATH}")
@@ -135,8 +129,18 @@ def train_model():
     print("\n🏗️  Building Transfer Learning model...")
     model = build_transfer_learning_model()
     
+    # Batched in-graph augmentation in front of the model, for training only
+    # (same ranges the ImageDataGenerator used); `model` itself is what gets saved
+    trainer = with_augmentation(model, build_augmentation(
+        rotation_range=15,
+        shift_range=0.1,
+        shear_range=0.1,
+        zoom_range=0.1,
+        horizontal_flip=True
+    ))
+    
     # Compile with lower learning rate (important for transfer learning)
-    model.compile(
+    trainer.compile(
         optimizer=keras.optimizers.Adam(learning_rate=0.0001),
         loss='binary_crossentropy',
         metrics=['accuracy', keras.metrics.Precision(), keras.metrics.Recall()]
@@ -153,14 +157,16 @@ def train_model():
             patience=3,
             min_lr=1e-7,
             verbose=1
-        )
+        ),
+        # images/sec, step time and batch-production time per epoch → model/training_throughput.jsonl
+        ThroughputLogger('train_transfer_learning', train_gen)
     ]
     
     # Train model
     print("\n🎯 Training with Transfer Learning...")
     print("(VGG16 base frozen, training only top layers)")
     
-    history = model.fit(
+    history = trainer.fit(
         train_gen,
         epochs=EPOCHS,
         validation_data=val_gen,
@@ -172,10 +178,11 @@ def train_model():
     # Save final model
     model.save(MODEL_SAVE_PATH)
     print(f"\n✅ Model saved to {MODEL_SAVE_PATH}")
+    print(f"   Publish for hot reload: python model_registry.py publish {MODEL_SAVE_PATH} --promote")
     
     # Evaluate on test set
     print("\n📈 Evaluating on test set...")
-    test_loss, test_acc, test_precision, test_recall = model.evaluate(test_gen)
+    test_loss, test_acc, test_precision, test_recall = trainer.evaluate(test_gen)
     
     print("\n" + "=" * 60)
     print("📊 TEST RESULTS:")
@@ -187,7 +194,7 @@ def train_model():
     
     # Generate predictions
     print("\n🔍 Generating predictions...")
-    y_pred = model.predict(test_gen)
+    y_pred = trainer.predict(test_gen)
     
     # Find optimal threshold
     print("\n🎯 Finding optimal prediction threshold...")
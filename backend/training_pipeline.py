@@ -0,0 +1,199 @@
+"""
+In-graph training augmentation and throughput instrumentation
+
+ImageDataGenerator augments one image at a time in NumPy/SciPy on the
+Python side, in front of the training step. build_augmentation() expresses
+the same transforms as Keras preprocessing layers, applied to whole
+batches inside the compiled training step:
+
+    ImageDataGenerator          preprocessing layer
+    horizontal_flip=True        RandomFlip('horizontal')
+    rotation_range=deg          RandomRotation(deg / 360)
+    width/height_shift_range    RandomTranslation
+    zoom_range                  RandomZoom (x and y independently)
+    shear_range=deg             RandomShear (below; Keras has no built-in)
+
+with_augmentation() wraps a model for training only. The wrapper shares
+the model's weights, and the model itself is what gets saved, so the
+served .h5 contains no augmentation layers.
+
+ThroughputLogger appends one JSON line per epoch to a log file with
+images/sec, step time and the time the generator spent producing batches.
+That last figure, timed in the producer itself, tells an input-bound run
+from a compute-bound one.
+"""
+
+import json
+import math
+import os
+import threading
+import time
+from datetime import datetime
+import numpy as np
+import tensorflow as tf
+from tensorflow import keras
+from tensorflow.keras import layers
+
+THROUGHPUT_LOG_PATH = 'model/training_throughput.jsonl'
+# Producer busy at least this much of the epoch = training waits on input
+INPUT_BOUND_FRACTION = 0.9
+
+
+class RandomShear(layers.Layer):
+    """Random shear by up to max_degrees, as ImageDataGenerator's shear_range"""
+
+    def __init__(self, max_degrees, fill_mode='nearest', **kwargs):
+        super().__init__(**kwargs)
+        self.max_degrees = max_degrees
+        self.fill_mode = fill_mode
+
+    def call(self, images, training=None):
+        if not training or not self.max_degrees:
+            return images
+        images = tf.convert_to_tensor(images, dtype=tf.float32)
+        batch = tf.shape(images)[0]
+        height = tf.cast(tf.shape(images)[1], tf.float32)
+        center_y = (height - 1.0) / 2.0
+
+        angle = tf.random.uniform([batch], -self.max_degrees, self.max_degrees) * (math.pi / 180.0)
+        sin, cos = tf.sin(angle), tf.cos(angle)
+        zeros = tf.zeros_like(angle)
+        ones = tf.ones_like(angle)
+        # Output pixel (x, y) samples input (x - sin*(y - cy), cos*(y - cy) + cy)
+        transforms = tf.stack(
+            [ones, -sin, sin * center_y, zeros, cos, center_y - cos * center_y, zeros, zeros],
+            axis=1
+        )
+        return tf.raw_ops.ImageProjectiveTransformV3(
+            images=images,
+            transforms=transforms,
+            output_shape=tf.shape(images)[1:3],
+            fill_value=0.0,
+            interpolation='BILINEAR',
+            fill_mode=self.fill_mode.upper()
+        )
+
+    def get_config(self):
+        config = super().get_config()
+        config.update({'max_degrees': self.max_degrees, 'fill_mode': self.fill_mode})
+        return config
+
+
+def build_augmentation(rotation_range=0, shift_range=0.0, shear_range=0.0,
+                       zoom_range=0.0, horizontal_flip=False, fill_mode='nearest'):
+    """Batched, in-graph equivalent of the ImageDataGenerator arguments of the same names"""
+    augmentation = []
+    if horizontal_flip:
+        augmentation.append(layers.RandomFlip('horizontal'))
+    if rotation_range:
+        augmentation.append(layers.RandomRotation(rotation_range / 360.0, fill_mode=fill_mode))
+    if shift_range:
+        augmentation.append(layers.RandomTranslation(shift_range, shift_range, fill_mode=fill_mode))
+    if shear_range:
+        augmentation.append(RandomShear(shear_range, fill_mode=fill_mode))
+    if zoom_range:
+        augmentation.append(layers.RandomZoom(
+            (-zoom_range, zoom_range), (-zoom_range, zoom_range), fill_mode=fill_mode
+        ))
+    return keras.Sequential(augmentation, name='augmentation')
+
+
+def with_augmentation(model, augmentation):
+    """
+    Training wrapper: augmentation -> model, sharing the model's weights
+    Augmentation layers are inactive outside training, so evaluate() and
+    predict() on the wrapper match the bare model.
+    """
+    return keras.Sequential(
+        [keras.Input(shape=model.input_shape[1:]), augmentation, model],
+        name=f'{model.name}_training'
+    )
+
+
+class ThroughputLogger(keras.callbacks.Callback):
+    """
+    Per-epoch training throughput, appended as JSON lines to log_path
+
+    Keras fetches each batch inside the training step (and the adapter may
+    prefetch on a background thread), so callback timestamps cannot
+    separate data loading from compute. Instead the generator's batch
+    producer is timed directly, on whichever thread calls it:
+    - input_seconds: time spent producing batches this epoch
+    - input_busy_fraction: input_seconds / training time. A single producer
+      that is busy (nearly) all the time is what the training loop is
+      waiting on, i.e. the run is input-bound.
+    - step time: on_train_batch_begin -> on_train_batch_end, which includes
+      any wait for the next batch
+    """
+
+    def __init__(self, run_name, generator, log_path=THROUGHPUT_LOG_PATH):
+        super().__init__()
+        self.run_name = run_name
+        self.batch_size = generator.batch_size
+        self.samples_per_epoch = generator.samples
+        self.log_path = log_path
+        self.run_id = f"{run_name}-{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}"
+        self._input_lock = threading.Lock()
+        self._input_seconds = 0.0
+        self._instrument(generator)
+
+    def _instrument(self, generator):
+        """Time ImageDataGenerator batch production (used by both __getitem__ and next())"""
+        produce = generator._get_batches_of_transformed_samples
+
+        def timed(index_array):
+            start = time.perf_counter()
+            try:
+                return produce(index_array)
+            finally:
+                with self._input_lock:
+                    self._input_seconds += time.perf_counter() - start
+
+        generator._get_batches_of_transformed_samples = timed
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._epoch_start = time.perf_counter()
+        self._last_step_end = self._epoch_start
+        self._step_start = None
+        self._step_times = []
+        with self._input_lock:
+            self._input_seconds = 0.0
+
+    def on_train_batch_begin(self, batch, logs=None):
+        self._step_start = time.perf_counter()
+
+    def on_train_batch_end(self, batch, logs=None):
+        self._last_step_end = time.perf_counter()
+        self._step_times.append(self._last_step_end - self._step_start)
+
+    def on_epoch_end(self, epoch, logs=None):
+        train_seconds = self._last_step_end - self._epoch_start
+        with self._input_lock:
+            input_seconds = self._input_seconds
+        steps = len(self._step_times)
+        images = min(steps * self.batch_size, self.samples_per_epoch)
+        step_ms = np.asarray(self._step_times) * 1000.0
+        busy = input_seconds / train_seconds if train_seconds else None
+
+        entry = {
+            'run': self.run_id,
+            'epoch': epoch + 1,
+            'steps': steps,
+            'images': images,
+            'train_seconds': round(train_seconds, 3),
+            'validation_seconds': round(time.perf_counter() - self._last_step_end, 3),
+            'images_per_sec': round(images / train_seconds, 1) if train_seconds else None,
+            'mean_step_ms': round(float(step_ms.mean()), 2) if steps else None,
+            'p95_step_ms': round(float(np.percentile(step_ms, 95)), 2) if steps else None,
+            'input_seconds': round(input_seconds, 3),
+            'input_ms_per_batch': round(input_seconds * 1000.0 / steps, 2) if steps else None,
+            'input_busy_fraction': round(busy, 4) if busy is not None else None,
+            'bound': 'input' if busy is not None and busy >= INPUT_BOUND_FRACTION else 'compute',
+            'timestamp': datetime.utcnow().isoformat()
+        }
+        os.makedirs(os.path.dirname(self.log_path) or '.', exist_ok=True)
+        with open(self.log_path, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+        print(f"\n⏱️  {entry['images_per_sec']} img/s, step {entry['mean_step_ms']} ms, "
+              f"input {entry['input_ms_per_batch']} ms/batch, producer busy "
+              f"{busy or 0:.0%} ({entry['bound']}-bound)")
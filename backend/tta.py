@@ -0,0 +1,136 @@
+"""
+Test-time augmentation (TTA) for /predict
+
+A fixed, deterministic set of augmentations mirroring the training
+ImageDataGenerator (horizontal flip, width/height shifts, zoom, with
+'nearest' fill) is applied to one preprocessed image in a single vectorized
+gather, and all copies are scored in one batched forward pass.
+
+Each augmentation is an axis-aligned affine map from output pixel to source
+pixel, so the source index grids are computed once per image size and
+cached; applying them is one NumPy fancy-indexing call.
+"""
+
+import threading
+import time
+from functools import lru_cache
+import numpy as np
+from config import Config
+
+# name -> (horizontal flip, shift direction y, shift direction x, zoom direction)
+# Directions are scaled by Config.TTA_SHIFT / Config.TTA_ZOOM
+TRANSFORMS = {
+    'identity': (False, 0, 0, 0),
+    'hflip': (True, 0, 0, 0),
+    'shift_left': (False, 0, -1, 0),
+    'shift_right': (False, 0, 1, 0),
+    'shift_up': (False, -1, 0, 0),
+    'shift_down': (False, 1, 0, 0),
+    'zoom_in': (False, 0, 0, 1),
+    'zoom_out': (False, 0, 0, -1)
+}
+
+# Running mean of single-pass latency, used to report TTA's extra cost
+_single_pass_ms = None
+_single_pass_lock = threading.Lock()
+
+
+def record_single_pass(latency):
+    """Feed the latency (seconds) of a normal single-image forward pass"""
+    global _single_pass_ms
+    ms = latency * 1000.0
+    with _single_pass_lock:
+        _single_pass_ms = ms if _single_pass_ms is None else 0.9 * _single_pass_ms + 0.1 * ms
+
+
+def _transform_params(name, shift, zoom):
+    flip, dy, dx, dz = TRANSFORMS[name]
+    return flip, dy * shift, dx * shift, 1.0 + dz * zoom
+
+
+@lru_cache(maxsize=8)
+def index_maps(height, width, names, shift, zoom):
+    """
+    Source row/column indices for every augmentation
+    Returns (rows, cols), each of shape (N, H, W)
+    Out-of-range sources are clipped, which matches fill_mode='nearest'.
+    """
+    cy, cx = (height - 1) / 2.0, (width - 1) / 2.0
+    ys = np.arange(height, dtype=np.float32)[:, None]
+    xs = np.arange(width, dtype=np.float32)[None, :]
+
+    rows, cols = [], []
+    for name in names:
+        flip, dy, dx, scale = _transform_params(name, shift, zoom)
+        # Output pixel (y, x) samples source (cy + (y - cy) / s - dy*H, ...)
+        src_y = cy + (ys - cy) / scale - dy * height
+        src_x = cx + (xs - cx) / scale - dx * width
+        if flip:
+            src_x = (width - 1) - src_x
+        src_y = np.broadcast_to(src_y, (height, width))
+        src_x = np.broadcast_to(src_x, (height, width))
+        rows.append(np.clip(np.rint(src_y), 0, height - 1).astype(np.intp))
+        cols.append(np.clip(np.rint(src_x), 0, width - 1).astype(np.intp))
+    return np.stack(rows), np.stack(cols)
+
+
+def configured_transforms():
+    """Augmentation names from Config.TTA_TRANSFORMS, validated"""
+    names = tuple(name.strip() for name in Config.TTA_TRANSFORMS.split(',') if name.strip())
+    unknown = [name for name in names if name not in TRANSFORMS]
+    if unknown:
+        raise ValueError(f'Unknown TTA transforms: {", ".join(unknown)}')
+    return names or ('identity',)
+
+
+def augment_batch(img_array, names=None, shift=None, zoom=None):
+    """
+    Expand a (1, H, W, C) image into an (N, H, W, C) augmented batch
+    """
+    names = names or configured_transforms()
+    shift = Config.TTA_SHIFT if shift is None else shift
+    zoom = Config.TTA_ZOOM if zoom is None else zoom
+    image = img_array[0]
+    rows, cols = index_maps(image.shape[0], image.shape[1], tuple(names), shift, zoom)
+    return image[rows, cols]
+
+
+def predict_tta(model, img_array):
+    """
+    Score all augmentations in one forward pass
+    model is a LoadedModel; the identity copy's embedding comes out of the
+    same pass, for the /similar index.
+    Returns (mean score, identity embedding or None, details dict)
+    """
+    names = configured_transforms()
+
+    start = time.perf_counter()
+    batch = augment_batch(img_array, names)
+    augment_ms = (time.perf_counter() - start) * 1000.0
+
+    start = time.perf_counter()
+    predictions, embeddings = model.predict_with_embedding(batch)
+    scores = predictions[:, 0].astype(np.float64)
+    inference_ms = (time.perf_counter() - start) * 1000.0
+
+    total_ms = augment_ms + inference_ms
+    with _single_pass_lock:
+        baseline = _single_pass_ms
+
+    embedding = None
+    if embeddings is not None and 'identity' in names:
+        embedding = embeddings[names.index('identity')]
+
+    score = float(scores.mean())
+    return score, embedding, {
+        'augmentations': list(names),
+        'scores': [round(float(s), 4) for s in scores],
+        'score_mean': round(score, 4),
+        'score_variance': round(float(scores.var()), 6),
+        'cost': {
+            'batch_size': len(names),
+            'augment_ms': round(augment_ms, 2),
+            'inference_ms': round(inference_ms, 2),
+            'extra_ms_vs_single': round(total_ms - baseline, 2) if baseline is not None else None
+        }
+    }
@@ -0,0 +1,289 @@
+"""
+Content-addressed upload store
+
+Uploads are saved under their SHA-256 digest in two levels of sharded
+subdirectories (uploads/ab/cd/abcd....png) so identical images are stored
+once, different images with the same filename never collide, and no single
+directory grows large enough to slow down lookups.
+
+A background sweeper keeps the store within an age and total-size budget.
+The MongoDB `uploads` collection is the manifest linking prediction records
+(via `image_digest`) to blobs and marks blobs that have been evicted.
+"""
+
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime
+from config import Config
+
+try:
+    import fcntl
+except ImportError:  # Windows - sweeper runs without cross-process locking
+    fcntl = None
+
+CHUNK_SIZE = 64 * 1024
+TMP_DIR = 'tmp'
+LOCK_FILE = '.sweep.lock'
+# Partial uploads left in TMP_DIR by a crashed worker are swept after this long
+STALE_TMP_SECONDS = 3600
+
+
+def blob_path(digest, ext):
+    """Sharded on-disk location of a blob"""
+    return os.path.join(
+        Config.UPLOAD_FOLDER, digest[:2], digest[2:4], f'{digest}.{ext}'
+    )
+
+
+def find_blob(digest):
+    """Path of a stored blob by digest, or None if unknown/evicted"""
+    if len(digest) != 64 or any(c not in '0123456789abcdef' for c in digest):
+        return None
+    shard = os.path.dirname(blob_path(digest, ''))
+    try:
+        for name in os.listdir(shard):
+            if name.startswith(digest + '.'):
+                return os.path.join(shard, name)
+    except FileNotFoundError:
+        pass
+    return None
+
+
+def normalize_extension(filename):
+    """Lower-cased extension with jpeg folded into jpg"""
+    ext = filename.rsplit('.', 1)[1].lower() if '.' in filename else 'bin'
+    return 'jpg' if ext == 'jpeg' else ext
+
+
+def save_upload(file, filename):
+    """
+    Stream an uploaded file to disk while hashing it
+    Returns (digest, path, size, deduplicated)
+    """
+    tmp_dir = os.path.join(Config.UPLOAD_FOLDER, TMP_DIR)
+    os.makedirs(tmp_dir, exist_ok=True)
+
+    sha = hashlib.sha256()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                chunk = file.stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                sha.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+
+        digest = sha.hexdigest()
+        path = blob_path(digest, normalize_extension(filename))
+
+        try:
+            # Same bytes already stored - refresh its age for the sweeper
+            os.utime(path)
+            os.remove(tmp_path)
+            return digest, path, size, True
+        except FileNotFoundError:
+            pass  # not stored, or evicted just now - store it
+
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+        except FileNotFoundError:
+            # The sweeper pruned the (empty) shard directory in between
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+        return digest, path, size, False
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def record_upload(db, digest, path, size, filename):
+    """
+    Upsert the manifest entry for a blob
+    """
+    try:
+        now = datetime.utcnow().isoformat()
+        db.uploads.update_one(
+            {'_id': digest},
+            {
+                '$setOnInsert': {'first_seen': now, 'original_filename': filename},
+                '$set': {'path': path, 'size': size, 'last_seen': now, 'evicted': False},
+                '$inc': {'references': 1}
+            },
+            upsert=True
+        )
+        return True
+    except Exception as e:
+        print(f"Error updating upload manifest: {str(e)}")
+        return False
+
+
+def _iter_blobs():
+    """Yield (mtime, size, path, digest) for every stored blob"""
+    root = Config.UPLOAD_FOLDER
+    for shard1 in os.listdir(root):
+        dir1 = os.path.join(root, shard1)
+        if len(shard1) != 2 or not os.path.isdir(dir1):
+            continue
+        for shard2 in os.listdir(dir1):
+            dir2 = os.path.join(dir1, shard2)
+            if not os.path.isdir(dir2):
+                continue
+            for entry in os.scandir(dir2):
+                if entry.is_file():
+                    st = entry.stat()
+                    digest = entry.name.split('.', 1)[0]
+                    yield st.st_mtime, st.st_size, entry.path, digest
+
+
+def _remove_blob(path):
+    """Delete a blob and prune its shard directories if empty"""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        return False
+    for directory in (os.path.dirname(path), os.path.dirname(os.path.dirname(path))):
+        try:
+            os.rmdir(directory)
+        except OSError:
+            break
+    return True
+
+
+def _remove_stale_tmp(max_age_seconds=STALE_TMP_SECONDS):
+    """Delete partial uploads abandoned in TMP_DIR (e.g. by a killed worker)"""
+    cutoff = time.time() - max_age_seconds
+    removed = 0
+    try:
+        entries = list(os.scandir(os.path.join(Config.UPLOAD_FOLDER, TMP_DIR)))
+    except FileNotFoundError:
+        return 0
+    for entry in entries:
+        try:
+            if entry.is_file() and entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+                removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
+
+
+def sweep(db=None, max_age_days=None, max_total_bytes=None):
+    """
+    Evict blobs older than max_age_days, then the least recently seen blobs
+    until the store fits in max_total_bytes. Stale partial uploads are
+    removed as well.
+    Returns a summary dict.
+    """
+    if max_age_days is None:
+        max_age_days = Config.UPLOAD_MAX_AGE_DAYS
+    if max_total_bytes is None:
+        max_total_bytes = Config.UPLOAD_MAX_BYTES
+
+    started = datetime.utcnow().isoformat()
+    cutoff = time.time() - max_age_days * 86400
+    blobs = sorted(_iter_blobs())
+    evicted = []
+    kept = []
+    for blob in blobs:
+        if max_age_days > 0 and blob[0] < cutoff:
+            evicted.append(blob)
+        else:
+            kept.append(blob)
+
+    total = sum(blob[1] for blob in kept)
+    if max_total_bytes > 0:
+        # kept is oldest-first, so trim from the front
+        index = 0
+        while total > max_total_bytes and index < len(kept):
+            evicted.append(kept[index])
+            total -= kept[index][1]
+            index += 1
+        kept = kept[index:]
+
+    freed = 0
+    removed = 0
+    for mtime, size, path, digest in evicted:
+        try:
+            if os.stat(path).st_mtime != mtime:
+                # Re-uploaded since the listing - keep it
+                kept.append((mtime, size, path, digest))
+                total += size
+                continue
+        except FileNotFoundError:
+            continue
+        if _remove_blob(path):
+            freed += size
+            removed += 1
+            if db is not None:
+                try:
+                    # Not if record_upload() has seen it again since the sweep started
+                    db.uploads.update_one(
+                        {'_id': digest, 'last_seen': {'$lt': started}},
+                        {'$set': {'evicted': True}}
+                    )
+                except Exception as e:
+                    print(f"Error updating upload manifest: {str(e)}")
+
+    return {
+        'evicted': removed,
+        'freed_bytes': freed,
+        'stale_tmp_removed': _remove_stale_tmp(),
+        'remaining': len(kept),
+        'remaining_bytes': total
+    }
+
+
+def _sweep_locked(db, tasks=()):
+    """
+    Run one sweep (plus any extra cleanup tasks) unless another worker
+    process is already sweeping
+    """
+    lock_path = os.path.join(Config.UPLOAD_FOLDER, LOCK_FILE)
+    with open(lock_path, 'a') as lock:
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return None
+        result = sweep(db)
+        for task in tasks:
+            try:
+                task()
+            except Exception as e:
+                print(f"Error in sweep task: {str(e)}")
+        return result
+
+
+def start_sweeper(db=None, interval=None, tasks=()):
+    """
+    Start the background eviction thread
+    Safe to call from every gunicorn worker - sweeps are serialized by a lock file
+    tasks: extra cleanup callables run after each sweep (e.g. other disk caches)
+    """
+    if interval is None:
+        interval = Config.UPLOAD_SWEEP_INTERVAL
+    if interval <= 0:
+        return None
+
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                result = _sweep_locked(db, tasks)
+                if result and result['evicted']:
+                    print(f"🧹 Upload sweep evicted {result['evicted']} blobs "
+                          f"({result['freed_bytes']} bytes)")
+            except Exception as e:
+                print(f"Error sweeping uploads: {str(e)}")
+
+    thread = threading.Thread(target=run, name='upload-sweeper', daemon=True)
+    thread.start()
+    return thread
@@ -1,33 +1,144 @@
+import hashlib
 import os
+import threading
 import numpy as np
+from collections import Counter
 from PIL import Image
-import tensorflow as tf
 from datetime import datetime
 from config import Config
+from rollups import update_rollups
+from response_cache import bump_data_version
+
+# Backstop for anything that reaches a full decode
+Image.MAX_IMAGE_PIXELS = Config.MAX_IMAGE_PIXELS
+
+# Rejection reasons from validate_image_header, exposed on the health check
+_rejections = Counter()
+_rejections_lock = threading.Lock()
+
+class ImageRejected(Exception):
+    """Raised when an upload fails header validation"""
+
+    def __init__(self, reason, message, status=400):
+        super().__init__(message)
+        self.reason = reason
+        self.message = message
+        self.status = status
 
 def allowed_file(filename):
     """Check if file extension is allowed"""
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in Config.ALLOWED_EXTENSIONS
 
-def preprocess_image(image_path):
+def record_rejection(reason):
+    """Count an upload rejection by reason"""
+    with _rejections_lock:
+        _rejections[reason] += 1
+
+def get_rejection_stats():
+    """Snapshot of upload rejection counts"""
+    with _rejections_lock:
+        return dict(_rejections)
+
+def validate_image_header(stream):
+    """
+    Check an uploaded image using only its header
+    - Format must be one of Config.ALLOWED_IMAGE_FORMATS
+    - Mode must be one of Config.ALLOWED_IMAGE_MODES
+    - Width/height/pixel count must be within configured limits
+    No pixel data is decoded. The stream is rewound afterwards.
+    Returns (format, width, height, mode) or raises ImageRejected.
+    """
+    try:
+        try:
+            # Image.open is lazy: it parses the header and stops
+            with Image.open(stream) as img:
+                fmt, (width, height), mode = img.format, img.size, img.mode
+        except Image.DecompressionBombError:
+            raise ImageRejected('too_many_pixels', 'Image has too many pixels.', 413)
+        except Exception:
+            raise ImageRejected('not_an_image', 'File is not a valid image.', 415)
+        finally:
+            stream.seek(0)
+
+        if fmt not in Config.ALLOWED_IMAGE_FORMATS:
+            raise ImageRejected(
+                'unsupported_format', f'Unsupported image format: {fmt}.', 415
+            )
+        if mode not in Config.ALLOWED_IMAGE_MODES:
+            raise ImageRejected(
+                'unsupported_mode', f'Unsupported image mode: {mode}.', 415
+            )
+        if width < Config.MIN_IMAGE_DIMENSION or height < Config.MIN_IMAGE_DIMENSION:
+            raise ImageRejected(
+                'dimensions_too_small',
+                f'Image is too small ({width}x{height}). '
+                f'Minimum side is {Config.MIN_IMAGE_DIMENSION}px.'
+            )
+        if width > Config.MAX_IMAGE_DIMENSION or height > Config.MAX_IMAGE_DIMENSION:
+            raise ImageRejected(
+                'dimensions_too_large',
+                f'Image is too large ({width}x{height}). '
+                f'Maximum side is {Config.MAX_IMAGE_DIMENSION}px.',
+                413
+            )
+        if width * height > Config.MAX_IMAGE_PIXELS:
+            raise ImageRejected('too_many_pixels', 'Image has too many pixels.', 413)
+
+        return fmt, width, height, mode
+    except ImageRejected as e:
+        record_rejection(e.reason)
+        raise
+
+def to_8bit(img):
+    """
+    Rescale a 16-bit ('I', 'I;16') image to 8-bit 'L'
+    convert('L'/'RGB') would clip every value above 255 to white instead.
+    """
+    if img.mode not in ('I', 'I;16', 'I;16L', 'I;16B'):
+        return img
+    pixels = np.clip(np.asarray(img, dtype=np.int64), 0, 65535)
+    return Image.fromarray((pixels >> 8).astype(np.uint8), 'L')
+
+def decode_image(image_path, input_shape=None):
+    """
+    Load an image as uint8 (height, width, channels) at the model input size
+    - Grayscale or RGB, matching the model's channel count
+    - 16-bit images are rescaled to 8-bit first (see to_8bit)
+    input_shape: (height, width, channels) of the loaded model;
+    defaults to Config.IMG_SIZE with 3 channels
+    """
+    if input_shape is None:
+        size, channels = Config.IMG_SIZE, 3
+    else:
+        size, channels = (input_shape[1], input_shape[0]), input_shape[2]
+    mode = 'L' if channels == 1 else 'RGB'
+    
+    # Load and resize image. draft() lets JPEG decode at reduced scale
+    # (and luma-only for grayscale) instead of decoding full resolution.
+    with Image.open(image_path) as img:
+        img.draft(mode, size)
+        img = to_8bit(img).convert(mode).resize(size)
+    
+    img_array = np.asarray(img, dtype=np.uint8)
+    
+    # Single-channel models expect an explicit channel axis
+    if channels == 1:
+        img_array = img_array[..., np.newaxis]
+    return img_array
+
+def preprocess_image(image_path, input_shape=None):
     """
     Preprocess image for model prediction
-    - Load image
-    - Resize to model input size
+    - Load and resize image (see decode_image)
     - Normalize pixel values
     - Add batch dimension
     """
     try:
-        # Load and resize image
-        img = Image.open(image_path).convert('RGB')
-        img = img.resize(Config.IMG_SIZE)
-        
-        # Convert to numpy array
-        img_array = np.array(img)
+        img_array = decode_image(image_path, input_shape)
         
         # Normalize to [0, 1]
-        img_array = img_array / 255.0
+        img_array = img_array.astype(np.float32) / 255.0
         
         # Add batch dimension
         img_array = np.expand_dims(img_array, axis=0)
@@ -49,23 +160,50 @@ def get_prediction_label(prediction_value, confidence):
     
     return label
 
-def save_prediction_to_db(db, filename, prediction, confidence):
+def save_prediction_to_db(db, filename, prediction, confidence, image_digest=None,
+                          phash=None, duplicate_of=None, model_version=None):
     """
     Save prediction result to MongoDB
+    image_digest links the record to its blob in the upload store
+    phash is the image's perceptual hash; duplicate_of the digest of the
+    near-duplicate whose result was reused
+    model_version is the model that produced the score
     """
     try:
+        now = datetime.utcnow()
         prediction_doc = {
             'filename': filename,
             'result': prediction,
             'confidence': float(confidence),
-            'timestamp': datetime.utcnow().isoformat()
+            'timestamp': now.isoformat()
         }
+        if image_digest is not None:
+            prediction_doc['image_digest'] = image_digest
+        if phash is not None:
+            prediction_doc['phash'] = f'{phash:016x}'
+        if duplicate_of is not None:
+            prediction_doc['duplicate_of'] = duplicate_of
+        if model_version is not None:
+            prediction_doc['model_version'] = model_version
         db.predictions.insert_one(prediction_doc)
+        # Invalidate cached /history and /stats responses in all workers,
+        # as soon as the record exists (even if the rollup update fails)
+        bump_data_version()
+        # Keep the hourly/daily aggregates used by ranged /stats current
+        update_rollups(db, [(now, prediction, confidence)])
         return True
     except Exception as e:
         print(f"Error saving to database: {str(e)}")
         return False
 
+def file_digest(path):
+    """SHA-256 of a file on disk (used to version the loaded model)"""
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
 def create_upload_folder():
     """Create upload folder if it doesn't exist"""
     if not os.path.exists(Config.UPLOAD_FOLDER):